@@ -284,17 +284,17 @@ export class PubSubContentRepository implements ContentRepository {
     this.currentPlayerProfileCallback = cb;
   }
 
-  // Send requests to specific groups
+  // Send requests to specific groups. requestId lets navigation replicas agree on who answers.
   async requestFile(filename: string): Promise<void> {
     if (!this.client) return;
-    await this.client.sendToGroup('navigation', { type: 'requestFile', filename }, 'json', {
+    await this.client.sendToGroup('navigation', { type: 'requestFile', filename, requestId: crypto.randomUUID() }, 'json', {
       noEcho: true,
     });
   }
 
   async requestMarkdown(filename: string): Promise<void> {
     if (!this.client) return;
-    await this.client.sendToGroup('navigation', { type: 'requestMarkdown', filename }, 'json', {
+    await this.client.sendToGroup('navigation', { type: 'requestMarkdown', filename, requestId: crypto.randomUUID() }, 'json', {
       noEcho: true,
     });
   }
@@ -308,7 +308,7 @@ export class PubSubContentRepository implements ContentRepository {
 
   async sendNavigationChange(filename: string): Promise<void> {
     if (!this.client) return;
-    await this.client.sendToGroup('navigation', { type: 'navigation_change', filename }, 'json', {
+    await this.client.sendToGroup('navigation', { type: 'navigation_change', filename, requestId: crypto.randomUUID() }, 'json', {
       noEcho: true,
     });
   }
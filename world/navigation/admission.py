@@ -0,0 +1,44 @@
+# admission.py
+import logging
+from typing import Optional
+from azure.messaging.webpubsubservice import WebPubSubServiceClient
+from delivery import DeliveryScheduler, Recipient, deliver_response
+from partitioning import message_sender
+from rate_limit import RateLimiter, build_rate_limited_response
+from metrics import NAVIGATION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+
+def admit_message(event,
+                  service_client: WebPubSubServiceClient,
+                  rate_limiter: Optional[RateLimiter] = None,
+                  partitioner=None,
+                  delivery: Optional[DeliveryScheduler] = None) -> Optional[Recipient]:
+    """
+    Decide on the callback thread whether a group message is handled, returning its sender if so.
+
+    Rate limiting runs before partitioning: every replica sees every group message,
+    so a flood is rejected without a claim round trip per message, and each replica's
+    local buckets count all of a sender's traffic rather than the share it owns.
+    """
+    sender = message_sender(event)
+    if sender is None:
+        # Nothing to key a bucket or address a reply on
+        logger.warning("⚠️ Dropping group message without a sender")
+        NAVIGATION_REJECTED.labels('anonymous').inc()
+        return None
+
+    if rate_limiter:
+        retry_after = rate_limiter.check(sender.key)
+        if retry_after is not None:
+            NAVIGATION_REJECTED.labels('rate_limited').inc()
+            # Every replica rejects the message; only its owner sends the (already throttled) notice
+            if rate_limiter.should_notify(sender.key) and (not partitioner or partitioner.should_handle(event)):
+                deliver_response(service_client, sender, build_rate_limited_response(retry_after),
+                                 delivery, label="rate limit notice")
+            return None
+
+    if partitioner and not partitioner.should_handle(event):
+        return None
+    return sender
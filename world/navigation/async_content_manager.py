@@ -0,0 +1,143 @@
+# async_content_manager.py
+import logging
+from typing import Any, List, Optional, Tuple, Union
+import redis.asyncio as redis_asyncio
+from redis.client import NEVER_DECODE
+from azure.messaging.webpubsubservice import WebPubSubServiceClient
+from navigation_cache import NavigationCache
+from redis_scripts import assemble_document_async
+from version_store import get_version_sections_async
+from delivery import DeliveryScheduler, Recipient, deliver_response
+from presence import PresenceIndex
+from singleflight import AsyncSingleFlight, DuplicateFilter
+from event_sink import EventSink, build_system_event, queue_system_events
+from navigation_core import Steps, navigation_steps, connect_batch_steps, disconnect_steps
+
+# The asyncio runtime's I/O layer: the same navigation_core steps as content_manager.py,
+# with Redis reads awaited on the event loop. Replies and system events go through the
+# thread-backed DeliveryScheduler and EventSink, whose send/record only enqueue.
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRedisPort:
+    """Performs navigation_core operations with the asyncio Redis client"""
+
+    def __init__(self,
+                 redis_client: redis_asyncio.Redis,
+                 pubsub_service: Optional[WebPubSubServiceClient] = None,
+                 delivery: Optional[DeliveryScheduler] = None,
+                 events: Optional[EventSink] = None,
+                 presence: Optional[PresenceIndex] = None,
+                 flights: Optional[AsyncSingleFlight] = None):
+        self.redis_client = redis_client
+        self.pubsub_service = pubsub_service
+        self.delivery = delivery
+        self.events = events
+        self.presence = presence
+        self.flights = flights
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return await self.redis_client.mget(keys)
+
+    async def mget_raw(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.redis_client.execute_command('MGET', *keys, **{NEVER_DECODE: True})
+
+    async def assemble_document(self, metadata_key: str):
+        return await assemble_document_async(self.redis_client, metadata_key)
+
+    async def read_version(self, nav_key: str, version: str):
+        return await get_version_sections_async(self.redis_client, nav_key, version)
+
+    async def page_presence(self, nav_key: str):
+        return await self.presence.page_presence(nav_key)
+
+    async def touch_presence(self, entries: List[Tuple[str, Optional[str], Optional[str]]]) -> None:
+        await self.presence.touch(entries)
+
+    async def leave_presence(self, connection_ids: List[str]) -> None:
+        await self.presence.leave(connection_ids)
+
+    async def deliver(self, recipient: Recipient, response: Union[str, bytes], label: str) -> None:
+        deliver_response(self.pubsub_service, recipient, response, self.delivery, label)
+
+    async def record_events(self, event_type: str, events: List[Tuple[str, dict]]) -> None:
+        """Buffer through the event sink when there is one, otherwise write in one pipeline"""
+        if self.events:
+            for connection_id, data in events:
+                self.events.record(event_type, connection_id, data)
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        queue_system_events(pipe, [build_system_event(event_type, connection_id, data) for connection_id, data in events])
+        await pipe.execute()
+        logger.info(f"Stored {len(events)} system event(s): {event_type}")
+
+    async def shared(self, key, steps: Steps) -> Any:
+        """Await steps once for all concurrent requests of the same key"""
+        if self.flights:
+            return await self.flights.do(key, lambda: drive(steps, self))
+        return await drive(steps, self)
+
+
+async def drive(steps: Steps, port: AsyncRedisPort) -> Any:
+    """asyncio variant of content_manager.drive"""
+    result, error = None, None
+    while True:
+        try:
+            operation = steps.throw(error) if error else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        name, *args = operation
+        try:
+            result, error = await getattr(port, name)(*args), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def handle_navigation_event(redis_client: redis_asyncio.Redis,
+                                  pubsub_service: WebPubSubServiceClient,
+                                  content: str,
+                                  sender: Recipient,
+                                  cache: Optional[NavigationCache] = None,
+                                  delivery: Optional[DeliveryScheduler] = None,
+                                  presence: Optional[PresenceIndex] = None,
+                                  flights: Optional[AsyncSingleFlight] = None,
+                                  duplicates: Optional[DuplicateFilter] = None,
+                                  prefetch_hints: int = 0) -> None:
+    """Handle navigation events; failed sends are retried by the delivery scheduler"""
+    port = AsyncRedisPort(redis_client, pubsub_service, delivery=delivery, presence=presence, flights=flights)
+    await drive(navigation_steps(content, sender, cache, duplicates, presence is not None, prefetch_hints), port)
+
+
+async def handle_connect_batch(redis_client: redis_asyncio.Redis,
+                               pubsub_service: WebPubSubServiceClient,
+                               connections: List[Tuple[str, dict]],
+                               cache: Optional[NavigationCache] = None,
+                               delivery: Optional[DeliveryScheduler] = None,
+                               events: Optional[EventSink] = None,
+                               presence: Optional[PresenceIndex] = None) -> None:
+    """Handle a burst of client connections: fetch the root document once and fan it out"""
+    port = AsyncRedisPort(redis_client, pubsub_service, delivery=delivery, events=events, presence=presence)
+    await drive(connect_batch_steps(connections, cache, presence is not None), port)
+
+
+async def handle_connect_event(redis_client: redis_asyncio.Redis,
+                               pubsub_service: WebPubSubServiceClient,
+                               connection_id: str,
+                               user_data: Optional[dict] = None,
+                               cache: Optional[NavigationCache] = None,
+                               delivery: Optional[DeliveryScheduler] = None,
+                               events: Optional[EventSink] = None,
+                               presence: Optional[PresenceIndex] = None) -> None:
+    """Handle client connection with initial navigation load"""
+    await handle_connect_batch(redis_client, pubsub_service, [(connection_id, user_data or {})], cache, delivery,
+                               events, presence)
+
+
+async def handle_disconnect_event(redis_client: redis_asyncio.Redis,
+                                  connection_id: str,
+                                  events: Optional[EventSink] = None,
+                                  presence: Optional[PresenceIndex] = None) -> None:
+    """Handle client disconnection"""
+    await drive(disconnect_steps(connection_id, presence is not None),
+                AsyncRedisPort(redis_client, events=events, presence=presence))
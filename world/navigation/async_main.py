@@ -0,0 +1,220 @@
+# async_main.py
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Optional
+from azure.messaging.webpubsubclient.models import CallbackType
+from connection_manager import create_redis_client, create_async_redis_client, create_service_client
+from navigation_cache import NavigationCache
+from cache_invalidation import CacheInvalidationListener
+from sample_content import populate_initial_content
+from redis_scripts import register_scripts
+from async_content_manager import handle_navigation_event, handle_connect_batch, handle_disconnect_event
+from delivery import DeliveryScheduler
+from event_sink import EventSink
+from partitioning import create_partitioner, PARTITION_MODE_NONE
+from singleflight import AsyncSingleFlight, DuplicateFilter, DEFAULT_DUPLICATE_WINDOW
+from rate_limit import create_rate_limiter
+from metrics import start_metrics_server
+from admission import admit_message
+from presence import PresenceIndex, PresenceReaper, DEFAULT_PRESENCE_TTL
+from link_graph import DEFAULT_PREFETCH_HINTS
+from navigation_core import MAX_DELIVERY_ATTEMPTS
+from connect_batcher import AsyncConnectBatcher, DEFAULT_CONNECT_BATCH_WINDOW, DEFAULT_CONNECT_BATCH_SIZE
+from pubsub_runner import run_pubsub_service
+
+logger = logging.getLogger(__name__)
+
+PER_CONNECTION_QUEUE_SIZE = 16
+CONNECTION_IDLE_TIMEOUT = 60.0
+DRAIN_TIMEOUT = 10.0
+
+
+class ConnectionTaskQueues:
+    """
+    Bounded task queue per connection.
+
+    Jobs for one connection run in order, while different connections run
+    concurrently, so a slow lookup only delays its own connection.
+    Idle workers exit after CONNECTION_IDLE_TIMEOUT to keep memory flat.
+    """
+
+    def __init__(self, max_pending: int = PER_CONNECTION_QUEUE_SIZE, idle_timeout: float = CONNECTION_IDLE_TIMEOUT):
+        self.max_pending = max_pending
+        self.idle_timeout = idle_timeout
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+    def submit(self, connection_id: str, job: Callable[[], Awaitable[None]]) -> bool:
+        """Queue a job for a connection; returns False if its queue is full"""
+        queue = self._queues.get(connection_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.max_pending)
+            self._queues[connection_id] = queue
+            self._workers[connection_id] = asyncio.create_task(self._run(connection_id, queue))
+
+        try:
+            queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"⚠️ Dropping request for {connection_id}: {self.max_pending} requests already pending")
+            return False
+
+    async def _run(self, connection_id: str, queue: asyncio.Queue) -> None:
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error(f"Error processing job for {connection_id}: {e}", exc_info=True)
+                finally:
+                    queue.task_done()
+        finally:
+            self._queues.pop(connection_id, None)
+            self._workers.pop(connection_id, None)
+
+    async def close(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Let pending jobs finish, then stop all workers"""
+        queues = list(self._queues.values())
+        if queues:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(q.join() for q in queues)), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Timed out draining connection queues")
+
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def create_sync_redis_client(config: dict):
+    """Sync client for seeding content and for the blocking invalidation subscriber"""
+    client = create_redis_client(config)
+    populate_initial_content(client)
+    register_scripts(client)
+    return client
+
+
+async def run_async_service(redis_config: dict,
+                            pubsub_config: dict,
+                            shutdown_event: threading.Event,
+                            cache: Optional[NavigationCache] = None,
+                            service_config: Optional[dict] = None) -> None:
+    """
+    Run the navigation service on asyncio.
+
+    The WebPubSub client still delivers callbacks on its own thread; each callback
+    only hands a job to the event loop, where Redis reads run concurrently. Replies
+    and system events are queued to the same DeliveryScheduler and EventSink threads
+    as the threaded runtime, so retries and dead letters behave the same in both.
+    """
+    loop = asyncio.get_running_loop()
+    sync_redis_client = await asyncio.to_thread(create_sync_redis_client, redis_config)
+    invalidation_listener = None
+    if cache:
+        invalidation_listener = CacheInvalidationListener(sync_redis_client, cache)
+        invalidation_listener.start()
+
+    redis_client = await create_async_redis_client(redis_config)
+    service_client = create_service_client(pubsub_config)
+    queues = ConnectionTaskQueues()
+    service_config = service_config or {}
+    events = EventSink(sync_redis_client)
+    events.start()
+    delivery = DeliveryScheduler(events, max_attempts=MAX_DELIVERY_ATTEMPTS)
+    delivery.start()
+    presence_ttl = service_config.get('presence_ttl', DEFAULT_PRESENCE_TTL)
+    presence = PresenceIndex(redis_client, ttl=presence_ttl)
+    # Expiry runs on the sync client in its own thread, next to the invalidation listener
+    presence_reaper = PresenceReaper(PresenceIndex(sync_redis_client, ttl=presence_ttl))
+    presence_reaper.start()
+    if 'metrics_port' in service_config:
+        # Scrapes run on the metrics server's thread, so they read presence through the sync client
+        start_metrics_server(service_config['metrics_port'], cache, presence_reaper.presence)
+    # Admission runs on the callback thread too, so shared buckets use the sync client
+    rate_limiter = create_rate_limiter(service_config, sync_redis_client) if service_config else None
+    flights = AsyncSingleFlight()
+    duplicates = DuplicateFilter(window=service_config.get('duplicate_window', DEFAULT_DUPLICATE_WINDOW))
+    prefetch_hints = service_config.get('prefetch_hints', DEFAULT_PREFETCH_HINTS)
+    # Ownership is decided on the callback thread, before a job reaches the event loop
+    partitioner = create_partitioner(sync_redis_client, service_config.get('partition_mode', PARTITION_MODE_NONE))
+    if partitioner:
+        partitioner.start()
+    connect_batcher = AsyncConnectBatcher(
+        lambda connections: handle_connect_batch(
+            redis_client=redis_client,
+            pubsub_service=service_client,
+            connections=connections,
+            cache=cache,
+            delivery=delivery,
+            events=events,
+            presence=presence
+        ),
+        window=service_config.get('connect_batch_window', DEFAULT_CONNECT_BATCH_WINDOW),
+        max_batch=service_config.get('connect_batch_size', DEFAULT_CONNECT_BATCH_SIZE)
+    )
+
+    def schedule(connection_id: str, job: Callable[[], Awaitable[None]]) -> None:
+        loop.call_soon_threadsafe(queues.submit, connection_id, job)
+
+    def callbacks_factory(_sync_service_client) -> Dict[CallbackType, Callable]:
+        def on_connected(event):
+            logger.info(f"✅ Connected: {event.connection_id}")
+            loop.call_soon_threadsafe(connect_batcher.submit, event.connection_id, getattr(event, 'user_data', None))
+
+        def on_disconnected(event):
+            logger.warning(f"⚠️ Disconnected: {event.message}")
+            schedule(event.connection_id, lambda: handle_disconnect_event(
+                redis_client=redis_client,
+                connection_id=event.connection_id,
+                events=events,
+                presence=presence
+            ))
+
+        def on_message(event):
+            sender = admit_message(event, service_client, rate_limiter, partitioner, delivery)
+            if not sender:
+                return
+            schedule(sender.key, lambda: handle_navigation_event(
+                redis_client=redis_client,
+                pubsub_service=service_client,
+                content=event.data,
+                sender=sender,
+                cache=cache,
+                delivery=delivery,
+                presence=presence,
+                flights=flights,
+                duplicates=duplicates,
+                prefetch_hints=prefetch_hints
+            ))
+
+        return {
+            CallbackType.CONNECTED: on_connected,
+            CallbackType.DISCONNECTED: on_disconnected,
+            CallbackType.GROUP_MESSAGE: on_message,
+            CallbackType.SERVER_MESSAGE: lambda e: logger.info(f"🔵 Server message: {e.data}"),
+        }
+
+    try:
+        logger.info("✅ All services started successfully (asyncio)")
+        await asyncio.to_thread(run_pubsub_service, pubsub_config, callbacks_factory, shutdown_event)
+    finally:
+        if partitioner:
+            partitioner.stop()
+        await connect_batcher.close()
+        await queues.close()
+        # Replies queued by the drained jobs go out before the clients close
+        await asyncio.to_thread(delivery.stop)
+        await asyncio.to_thread(events.stop)
+        presence_reaper.stop()
+        service_client.close()
+        await redis_client.aclose()
+        if invalidation_listener:
+            invalidation_listener.stop()
+        sync_redis_client.close()
+        logger.info("Redis client closed")
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# benchmark.py
+"""
+Load generator and latency benchmark for the navigation service.
+
+Connect and group message events are dispatched by a stand-in WebPubSubClient
+to the callbacks built by main.create_navigation_callbacks, so every request
+goes through admission (rate limiting, partitioning) before the handlers.
+Replies go through the DeliveryScheduler to a stand-in for the Web PubSub
+service, with either fakeredis (default; needs `pip install fakeredis lupa`)
+or a real redis-server given with --redis-url --flush. No Azure resources are
+involved.
+
+    python benchmark.py --connections 2000 --output baseline.json
+    python benchmark.py --compare baseline.json
+
+With --compare the run fails (exit code 1) when latency or Redis calls per
+request grow, or throughput drops, by more than --tolerance.
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import redis
+from redis.client import Pipeline
+from prometheus_client import REGISTRY
+from azure.messaging.webpubsubclient.models import (
+    CallbackType,
+    OnConnectedArgs,
+    OnGroupDataMessageArgs,
+    WebPubSubDataType,
+)
+from navigation_cache import NavigationCache
+from redis_scripts import register_scripts
+from singleflight import SingleFlight, DuplicateFilter
+from delivery import DeliveryScheduler, DEFAULT_DELIVERY_WORKERS
+from event_sink import EventSink, DEAD_LETTER_STREAM
+from partitioning import create_partitioner, PARTITION_MODES, PARTITION_MODE_NONE
+from rate_limit import create_rate_limiter, DEFAULT_CONNECTION_RATE, DEFAULT_CONNECTION_BURST, DEFAULT_GLOBAL_BURST
+from sample_content import create_navigation_key, queue_navigation_sections, populate_initial_content
+from main import create_navigation_callbacks
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_FORMAT_VERSION = 3
+BENCHMARK_GROUP = "navigation"
+DELIVERY_DRAIN_TIMEOUT = 60.0
+# Regression checks: (section, metric, True if larger is worse)
+COMPARED_METRICS = [
+    ("connect", "p50_ms", True),
+    ("connect", "p99_ms", True),
+    ("navigation", "p50_ms", True),
+    ("navigation", "p99_ms", True),
+    ("navigation", "throughput_rps", False),
+    ("connect", "redis_calls_per_request", True),
+    ("navigation", "redis_calls_per_request", True),
+]
+
+
+class FakeWebPubSubService:
+    """
+    Stand-in for WebPubSubServiceClient's send_to_connection and send_to_user.
+
+    Optionally adds a fixed send latency and fails a fraction of sends with the
+    same exception type the real client raises, so the delivery scheduler's
+    retries and dead letters get exercised.
+    """
+
+    def __init__(self, send_latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.send_latency = send_latency
+        self.failure_rate = failure_rate
+        self.sent = 0
+        self.bytes_sent = 0
+        self.failed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send_to_connection(self, connection_id: str, message, content_type: str = "application/json", **kwargs) -> None:
+        self._send(message)
+
+    def send_to_user(self, user_id: str, message, content_type: str = "application/json", **kwargs) -> None:
+        self._send(message)
+
+    def _send(self, message) -> None:
+        from azure.core.exceptions import ServiceRequestError
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        with self._lock:
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.failed += 1
+                raise ServiceRequestError("simulated send failure")
+            self.sent += 1
+            self.bytes_sent += len(message)
+
+
+class FakeWebPubSubClient:
+    """
+    Stand-in for WebPubSubClient.
+
+    Callbacks are subscribed the way pubsub_runner does it, and dispatch() runs
+    them on the calling thread, as the real client's receive thread would.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[CallbackType, List[Callable]] = {}
+
+    def subscribe(self, callback_type: CallbackType, callback: Callable) -> None:
+        self._callbacks.setdefault(callback_type, []).append(callback)
+
+    def dispatch(self, callback_type: CallbackType, event) -> None:
+        for callback in self._callbacks.get(callback_type, []):
+            callback(event)
+
+
+class CountingPipeline(Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        self.counter.increment()
+        return super().execute(raise_on_error)
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def increment(self) -> None:
+        with self._lock:
+            self.count += 1
+
+
+def counting_client(client_class, counter: RoundTripCounter):
+    """Subclass of client_class that counts round trips: one per command, one per pipeline"""
+
+    class CountingClient(client_class):
+        def execute_command(self, *args, **options):
+            counter.increment()
+            return super().execute_command(*args, **options)
+
+        def pipeline(self, transaction: bool = True, shard_hint=None):
+            pipe = CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+            pipe.counter = counter
+            return pipe
+
+    return CountingClient
+
+
+def create_benchmark_redis(redis_url: Optional[str], counter: RoundTripCounter, flush: bool = False) -> redis.Redis:
+    if redis_url:
+        if not flush:
+            sys.exit(f"The benchmark flushes the database at {redis_url} before seeding it; pass --flush to confirm")
+        client = counting_client(redis.Redis, counter).from_url(redis_url, decode_responses=True)
+        client.flushdb()
+        return client
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("fakeredis is not installed; run `pip install fakeredis lupa` or pass --redis-url")
+    return counting_client(fakeredis.FakeRedis, counter)(decode_responses=True)
+
+
+def seed_documents(redis_client: redis.Redis, documents: int, sections: int, section_size: int) -> List[str]:
+    """Write synthetic multi-section documents next to the sample content; returns every nav key"""
+    populate_initial_content(redis_client)
+    nav_keys = [create_navigation_key("main.markdown.root")]
+    filler = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+    body = (filler * (section_size // len(filler) + 1))[:section_size]
+
+    pipe = redis_client.pipeline(transaction=False)
+    for index in range(documents):
+        nav_key = create_navigation_key(f"bench.markdown.document_{index}")
+        queue_navigation_sections(pipe, nav_key, [f"# Section {s}\n{body}" for s in range(sections)])
+        nav_keys.append(nav_key)
+    pipe.execute()
+    return nav_keys
+
+
+def pick_documents(nav_keys: List[str], count: int, skew: float, rng: random.Random) -> List[str]:
+    """Zipf-like popularity: a few pages get most views, like a busy town square"""
+    weights = [1 / ((rank + 1) ** skew) for rank in range(len(nav_keys))]
+    return rng.choices(nav_keys, weights=weights, k=count)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float, redis_calls: int) -> Dict[str, float]:
+    count = len(latencies)
+    return {
+        "requests": count,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "redis_calls_per_request": round(redis_calls / count, 3) if count else 0.0,
+    }
+
+
+def rejected_count() -> Dict[str, int]:
+    """Messages dropped at admission or routing so far, by reason"""
+    return {
+        reason: int(REGISTRY.get_sample_value('navigation_rejected_total', {'reason': reason}) or 0)
+        for reason in ('anonymous', 'rate_limited', 'duplicate', 'invalid')
+    }
+
+
+def wait_for_delivery(delivery: DeliveryScheduler, timeout: float = DELIVERY_DRAIN_TIMEOUT) -> None:
+    """Block until every queued reply is sent or dead-lettered"""
+    deadline = time.monotonic() + timeout
+    while delivery.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    if delivery.pending_count():
+        logger.warning(f"⚠️ {delivery.pending_count()} replies still pending after {timeout}s")
+
+
+def run_phase(jobs: List[Callable[[], None]],
+              workers: int,
+              counter: RoundTripCounter,
+              delivery: DeliveryScheduler) -> Dict[str, float]:
+    """
+    Run jobs on a thread pool, timing each one.
+
+    Per-request latency is the callback's time: admission plus the handler, which
+    ends once the reply is queued; throughput and Redis calls include draining the delivery queue,
+    retries and dead letters.
+    """
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def timed(job: Callable[[], None]) -> None:
+        started = time.perf_counter()
+        job()
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+
+    calls_before = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(timed, jobs))
+    wait_for_delivery(delivery)
+    return summarize(latencies, time.perf_counter() - started, counter.count - calls_before)
+
+
+def run_phases(args: argparse.Namespace,
+               rng: random.Random,
+               counter: RoundTripCounter,
+               client: FakeWebPubSubClient,
+               nav_keys: List[str],
+               delivery: DeliveryScheduler) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """Connect every simulated client, then replay their navigation requests as group messages"""
+    user_ids = [f"bench-{index}" for index in range(args.connections)]
+    connect_jobs = [
+        (lambda event=OnConnectedArgs(connection_id=user_id, user_id=user_id):
+            client.dispatch(CallbackType.CONNECTED, event))
+        for user_id in user_ids
+    ]
+    connect = run_phase(connect_jobs, args.workers, counter, delivery)
+
+    navigation_jobs = []
+    for user_id in user_ids:
+        for nav_key in pick_documents(nav_keys, args.requests_per_connection, args.skew, rng):
+            # The request id lets claim partitioning claim the message, as a real client's would
+            message = {"type": "requestMarkdown", "filename": nav_key, "encoding": args.encoding,
+                       "requestId": f"{user_id}-{len(navigation_jobs)}"}
+            event = OnGroupDataMessageArgs(data_type=WebPubSubDataType.TEXT, data=json.dumps(message),
+                                           group=BENCHMARK_GROUP, from_user_id=user_id)
+            navigation_jobs.append(lambda event=event: client.dispatch(CallbackType.GROUP_MESSAGE, event))
+    rng.shuffle(navigation_jobs)
+    navigation = run_phase(navigation_jobs, args.workers, counter, delivery)
+    return connect, navigation
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    counter = RoundTripCounter()
+    redis_client = create_benchmark_redis(args.redis_url, counter, args.flush)
+    register_scripts(redis_client)
+    nav_keys = seed_documents(redis_client, args.documents, args.sections, args.section_size)
+    service = FakeWebPubSubService(args.send_latency, args.failure_rate, args.seed)
+    cache = NavigationCache(ttl=300, max_entries=args.cache_entries) if args.cache_entries else None
+    rate_limiter = create_rate_limiter({
+        "rate_limit": args.rate_limit,
+        "rate_burst": args.rate_burst,
+        "global_rate_limit": args.global_rate_limit,
+        "global_rate_burst": args.global_rate_burst,
+        "rate_limit_shared": args.rate_limit_shared,
+    }, redis_client)
+    partitioner = create_partitioner(redis_client, args.partition_mode)
+    if partitioner:
+        partitioner.start()
+    events = EventSink(redis_client)
+    events.start()
+    delivery = DeliveryScheduler(events, base_delay=args.retry_delay, workers=args.delivery_workers)
+    delivery.start()
+    client = FakeWebPubSubClient()
+    callbacks = create_navigation_callbacks(
+        redis_client,
+        service,
+        cache,
+        delivery=delivery,
+        events=events,
+        partitioner=partitioner,
+        flights=SingleFlight() if args.singleflight else None,
+        duplicates=DuplicateFilter(window=args.duplicate_window) if args.duplicate_window > 0 else None,
+        rate_limiter=rate_limiter,
+        prefetch_hints=args.prefetch_hints
+    )
+    for callback_type, callback in callbacks.items():
+        client.subscribe(callback_type, callback)
+    rejected_before = rejected_count()
+    try:
+        connect, navigation = run_phases(args, rng, counter, client, nav_keys, delivery)
+    finally:
+        delivery.stop()
+        events.stop()
+        if partitioner:
+            partitioner.stop()
+
+    dead_letters = redis_client.xlen(DEAD_LETTER_STREAM)
+    rejected = {reason: count - rejected_before[reason] for reason, count in rejected_count().items()}
+
+    return {
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": "redis" if args.redis_url else "fakeredis",
+        },
+        "config": {
+            "connections": args.connections,
+            "requests_per_connection": args.requests_per_connection,
+            "documents": args.documents,
+            "sections": args.sections,
+            "section_size": args.section_size,
+            "workers": args.workers,
+            "encoding": args.encoding,
+            "cache_entries": args.cache_entries,
+            "singleflight": args.singleflight,
+            "duplicate_window": args.duplicate_window,
+            "rate_limit": args.rate_limit,
+            "rate_burst": args.rate_burst,
+            "global_rate_limit": args.global_rate_limit,
+            "global_rate_burst": args.global_rate_burst,
+            "rate_limit_shared": args.rate_limit_shared,
+            "partition_mode": args.partition_mode,
+            "prefetch_hints": args.prefetch_hints,
+            "send_latency": args.send_latency,
+            "failure_rate": args.failure_rate,
+            "retry_delay": args.retry_delay,
+            "delivery_workers": args.delivery_workers,
+            "skew": args.skew,
+            "seed": args.seed,
+        },
+        "connect": connect,
+        "navigation": navigation,
+        "messages_sent": service.sent,
+        "bytes_sent": service.bytes_sent,
+        "send_failures": service.failed,
+        "dead_letters": dead_letters,
+        "rejected": rejected,
+        "cache": cache.stats() if cache else None,
+    }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Regressions beyond tolerance, as readable lines; empty when the run is within bounds"""
+    if baseline.get("config") != current.get("config"):
+        logger.warning("⚠️ Baseline was recorded with a different configuration; comparison is indicative only")
+
+    regressions = []
+    for section, metric, larger_is_worse in COMPARED_METRICS:
+        before = baseline.get(section, {}).get(metric)
+        after = current.get(section, {}).get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if (change > tolerance) if larger_is_worse else (change < -tolerance):
+            regressions.append(f"{section}.{metric}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the navigation service against local stand-ins for Web PubSub and Redis'
+    )
+    parser.add_argument('--connections', type=int, default=2000, help='Simulated connections (default: 2000)')
+    parser.add_argument('--requests-per-connection', type=int, default=5,
+                        help='Navigation requests sent by each connection (default: 5)')
+    parser.add_argument('--documents', type=int, default=200, help='Synthetic documents to seed (default: 200)')
+    parser.add_argument('--sections', type=int, default=4, help='Sections per synthetic document (default: 4)')
+    parser.add_argument('--section-size', type=int, default=1500, help='Characters per section (default: 1500)')
+    parser.add_argument('--workers', type=int, default=32, help='Concurrent handler threads (default: 32)')
+    parser.add_argument('--encoding', choices=['json', 'protobuf'], default='json', help='Reply encoding to request')
+    parser.add_argument('--cache-entries', type=int, default=1024,
+                        help='NavigationCache size; 0 disables the cache (default: 1024)')
+    parser.add_argument('--singleflight', action='store_true', help='Share concurrent loads of the same document')
+    parser.add_argument('--duplicate-window', type=float, default=0.0,
+                        help='Seconds a repeated request from the same sender is dropped for; 0 disables (default: 0)')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_CONNECTION_RATE,
+                        help=f'Messages per second per sender; 0 disables (default: {DEFAULT_CONNECTION_RATE:g})')
+    parser.add_argument('--rate-burst', type=int, default=DEFAULT_CONNECTION_BURST,
+                        help=f'Per-sender burst (default: {DEFAULT_CONNECTION_BURST})')
+    # The whole load arrives at once, far above what the service's global budget allows one replica
+    parser.add_argument('--global-rate-limit', type=float, default=0.0,
+                        help='Messages per second across all senders; 0 disables (default: 0)')
+    parser.add_argument('--global-rate-burst', type=int, default=DEFAULT_GLOBAL_BURST,
+                        help=f'Global burst (default: {DEFAULT_GLOBAL_BURST})')
+    parser.add_argument('--rate-limit-shared', action='store_true', help='Keep the rate limit buckets in Redis')
+    parser.add_argument('--partition-mode', choices=PARTITION_MODES, default=PARTITION_MODE_NONE,
+                        help=f'Partitioning of group messages across replicas (default: {PARTITION_MODE_NONE})')
+    parser.add_argument('--prefetch-hints', type=int, default=0,
+                        help='Linked documents announced after each reply (default: 0)')
+    parser.add_argument('--send-latency', type=float, default=0.0, help='Seconds added to every send (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of sends that fail (default: 0)')
+    parser.add_argument('--retry-delay', type=float, default=0.01,
+                        help='Base backoff of the delivery scheduler in seconds (default: 0.01)')
+    parser.add_argument('--delivery-workers', type=int, default=DEFAULT_DELIVERY_WORKERS,
+                        help=f'Delivery scheduler send threads (default: {DEFAULT_DELIVERY_WORKERS})')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of page popularity (default: 1.1)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+    parser.add_argument('--redis-url', help='Use this redis-server instead of fakeredis; requires --flush')
+    parser.add_argument('--flush', action='store_true',
+                        help='Allow flushing the --redis-url database before seeding it')
+    parser.add_argument('--output', help='Write the JSON results to this file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative regression before --compare fails (default: 0.2)')
+
+    args = parser.parse_args()
+    # main configures logging at import; replace that with the benchmark's quieter setup
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        force=True
+    )
+    # Injected failures are expected; only report messages that end up dead-lettered
+    logging.getLogger("delivery").setLevel(logging.ERROR)
+
+    results = run_benchmark(args)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n✅ Within {args.tolerance:.0%} of {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# cache_invalidation.py
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+import redis
+from navigation_cache import NavigationCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "woa.world.navigation.invalidate"
+CONTENT_KEY_PATTERN = "woa.world.*"
+# K: keyspace events, $: string commands, g: DEL/RENAME/EXPIRE, x: expired, e: evicted
+REQUIRED_KEYSPACE_FLAGS = "K$gxe"
+RESUBSCRIBE_BASE_DELAY = 1.0
+RESUBSCRIBE_MAX_DELAY = 30.0
+LISTEN_TIMEOUT = 1.0
+
+
+def publish_invalidation(redis_client: redis.Redis, keys: Iterable[str]) -> None:
+    """Tell every navigation replica that these content keys were rewritten"""
+    keys = list(keys)
+    if not keys:
+        return
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+    except Exception as e:
+        logger.error(f"Failed to publish cache invalidation: {e}", exc_info=True)
+
+
+def enable_keyspace_notifications(redis_client: redis.Redis) -> bool:
+    """
+    Make sure Redis emits keyspace events for content writes.
+
+    Azure Cache for Redis rejects CONFIG SET; there the setting must be enabled
+    on the cache itself, and the invalidation channel still covers our own writers.
+    """
+    try:
+        current = redis_client.config_get('notify-keyspace-events').get('notify-keyspace-events', '')
+        missing = "".join(flag for flag in REQUIRED_KEYSPACE_FLAGS if flag not in current)
+        if missing:
+            redis_client.config_set('notify-keyspace-events', current + missing)
+            logger.info(f"✅ Enabled keyspace notifications: {current + missing}")
+        return True
+    except redis.ResponseError as e:
+        logger.warning(f"⚠️ Could not configure keyspace notifications, relying on {INVALIDATION_CHANNEL}: {e}")
+        return False
+
+
+class CacheInvalidationListener:
+    """
+    Background subscriber that evicts cached documents when their Redis keys change.
+
+    Listens to keyspace notifications for woa.world.* keys and to the explicit
+    invalidation channel. Any gap in the subscription may have dropped events,
+    so the whole cache is cleared whenever the subscription is re-established.
+    """
+
+    def __init__(self, redis_client: redis.Redis, cache: NavigationCache, db: int = 0):
+        self.redis_client = redis_client
+        self.cache = cache
+        self.keyspace_pattern = f"__keyspace@{db}__:{CONTENT_KEY_PATTERN}"
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        enable_keyspace_notifications(self.redis_client)
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        attempt = 0
+        while not self._stop_event.is_set():
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.keyspace_pattern)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                self.cache.clear()
+                attempt = 0
+                logger.info(f"✅ Listening for content changes on {self.keyspace_pattern} and {INVALIDATION_CHANNEL}")
+
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if message:
+                        self._handle_message(message)
+
+            except redis.ConnectionError as e:
+                self.cache.clear()
+                delay = min(RESUBSCRIBE_BASE_DELAY * (2 ** attempt), RESUBSCRIBE_MAX_DELAY)
+                attempt += 1
+                logger.warning(f"Invalidation subscription lost, resubscribing in {delay}s: {e}")
+                self._stop_event.wait(timeout=delay)
+            except Exception as e:
+                logger.error(f"Error in cache invalidation listener: {e}", exc_info=True)
+                self._stop_event.wait(timeout=RESUBSCRIBE_BASE_DELAY)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def _handle_message(self, message: dict) -> None:
+        try:
+            if message['type'] == 'pmessage':
+                keys = [message['channel'].split(':', 1)[1]]
+            else:
+                keys = json.loads(message['data'])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Ignoring malformed invalidation message {message!r}: {e}")
+            return
+
+        for key in keys:
+            evicted = self.cache.invalidate_dependency(key)
+            if evicted:
+                logger.info(f"Invalidated {evicted} cached document(s) after change to {key}")
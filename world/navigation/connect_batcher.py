@@ -0,0 +1,111 @@
+# connect_batcher.py
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_BATCH_WINDOW = 0.05
+DEFAULT_CONNECT_BATCH_SIZE = 100
+
+PendingConnection = Tuple[str, dict]
+
+
+class ConnectBatcher:
+    """
+    Coalesce bursts of new connections into one initial-navigation fan-out.
+
+    During a deploy or reconnect storm every client connects within a few
+    milliseconds. Instead of fetching and serializing the root document once
+    per connection, connections are collected for up to `window` seconds (or
+    until `max_batch` are pending) and handed to `flush` together.
+    """
+
+    def __init__(self,
+                 flush: Callable[[List[PendingConnection]], None],
+                 window: float = DEFAULT_CONNECT_BATCH_WINDOW,
+                 max_batch: int = DEFAULT_CONNECT_BATCH_SIZE):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[PendingConnection] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, connection_id: str, user_data: Optional[dict] = None) -> None:
+        with self._lock:
+            self._pending.append((connection_id, user_data or {}))
+            if self.window > 0 and len(self._pending) < self.max_batch:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self._flush_pending)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self._flush_pending()
+
+    def stop(self) -> None:
+        """Deliver whatever is still pending without waiting for the window"""
+        self._flush_pending()
+
+    def _take_pending(self) -> List[PendingConnection]:
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            return batch
+
+    def _flush_pending(self) -> None:
+        batch = self._take_pending()
+        if not batch:
+            return
+        try:
+            self.flush(batch)
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} pending connection(s): {e}", exc_info=True)
+
+
+class AsyncConnectBatcher:
+    """asyncio variant of ConnectBatcher; submit and close must run on the event loop"""
+
+    def __init__(self,
+                 flush: Callable[[List[PendingConnection]], Awaitable[None]],
+                 window: float = DEFAULT_CONNECT_BATCH_WINDOW,
+                 max_batch: int = DEFAULT_CONNECT_BATCH_SIZE):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[PendingConnection] = []
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    def submit(self, connection_id: str, user_data: Optional[dict] = None) -> None:
+        self._pending.append((connection_id, user_data or {}))
+        if self.window > 0 and len(self._pending) < self.max_batch:
+            if self._handle is None:
+                self._handle = asyncio.get_running_loop().call_later(self.window, self._flush_pending)
+            return
+        self._flush_pending()
+
+    async def close(self) -> None:
+        self._flush_pending()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush_pending(self) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run_flush(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_flush(self, batch: List[PendingConnection]) -> None:
+        try:
+            await self.flush(batch)
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} pending connection(s): {e}", exc_info=True)
@@ -1,15 +1,100 @@
 # connection_manager.py
 import os
 import time
+import asyncio
 import logging
 from typing import Optional, Tuple
 import redis
+import redis.asyncio as redis_asyncio
 from azure.messaging.webpubsubservice import WebPubSubServiceClient
 from azure.messaging.webpubsubclient import WebPubSubClient
 from azure.messaging.webpubsubclient.models import CallbackType, SendMessageError
+from instrumented_redis import (
+    InstrumentedRedis,
+    AsyncInstrumentedRedis,
+    InstrumentedBlockingConnectionPool,
+    AsyncInstrumentedBlockingConnectionPool,
+)
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_POOL_TIMEOUT = 5.0
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+DEFAULT_SSL_CERT_REQS = "required"
+DEFAULT_SSL_CHECK_HOSTNAME = True
+
+
+def load_ssl_config_from_env() -> dict:
+    """
+    TLS verification settings from the environment.
+
+    REDIS_SSL_CERT_REQS=none only for local redis-server with a self-signed certificate.
+    REDIS_SSL_CHECK_HOSTNAME=false keeps certificate verification but skips the host name
+    check, for tunnels (enable-local-dev.sh) where 127.0.0.1 or host.docker.internal
+    stands in for the Azure host name on the certificate.
+    """
+    return {
+        "ssl_cert_reqs": os.environ.get('REDIS_SSL_CERT_REQS', DEFAULT_SSL_CERT_REQS).lower(),
+        "ssl_check_hostname": os.environ.get('REDIS_SSL_CHECK_HOSTNAME', str(DEFAULT_SSL_CHECK_HOSTNAME)).lower() == 'true',
+    }
+
+
+def build_redis_connection_kwargs(config: dict) -> dict:
+    """
+    Build Redis connection parameters shared by the sync and asyncio clients.
+    """
+    redis_password = os.getenv('REDIS_PASSWORD')
+    if not redis_password:
+        raise ValueError("❌ REDIS_PASSWORD environment variable not set")
+
+    is_docker = os.path.exists('/.dockerenv')
+    redis_host = 'host.docker.internal' if is_docker else config.get('host', '127.0.0.1')
+    redis_port = config.get('port', 6380)
+    redis_ssl = config.get('use_ssl', True)
+
+    # Redis connection parameters optimized for resilience
+    connection_kwargs = {
+        'host': redis_host,
+        'port': redis_port,
+        'password': redis_password,
+        'decode_responses': True,
+        'socket_keepalive': True,
+        'socket_connect_timeout': 5,
+        'socket_timeout': 5,
+        'retry_on_timeout': True,
+        'retry_on_error': [redis.exceptions.ConnectionError],
+        # PING idle connections before reuse so dropped sockets surface at checkout, not mid-request
+        'health_check_interval': config.get('health_check_interval', DEFAULT_HEALTH_CHECK_INTERVAL),
+    }
+
+    # Add SSL settings if enabled
+    if redis_ssl:
+        cert_reqs = config.get('ssl_cert_reqs', DEFAULT_SSL_CERT_REQS)
+        connection_kwargs.update({
+            'ssl': True,
+            'ssl_cert_reqs': cert_reqs,
+            'ssl_check_hostname': cert_reqs == "required" and config.get('ssl_check_hostname', DEFAULT_SSL_CHECK_HOSTNAME),
+        })
+
+    return connection_kwargs
+
+
+def build_connection_pool(config: dict, use_asyncio: bool = False):
+    """
+    Blocking connection pool: when every connection is busy, callers wait up to
+    pool_timeout for one to be released instead of failing immediately.
+    """
+    connection_kwargs = build_redis_connection_kwargs(config)
+    if connection_kwargs.pop('ssl', False):
+        connection_kwargs['connection_class'] = redis_asyncio.SSLConnection if use_asyncio else redis.SSLConnection
+    pool_class = AsyncInstrumentedBlockingConnectionPool if use_asyncio else InstrumentedBlockingConnectionPool
+    return pool_class(
+        max_connections=config.get('max_connections', DEFAULT_MAX_CONNECTIONS),
+        timeout=config.get('pool_timeout', DEFAULT_POOL_TIMEOUT),
+        **connection_kwargs
+    )
+
 
 def create_redis_client(config: dict) -> redis.Redis:
     """
@@ -17,38 +102,14 @@ def create_redis_client(config: dict) -> redis.Redis:
     Redis itself has robust retry and reconnection logic that we leverage.
     """
     try:
-        redis_password = os.getenv('REDIS_PASSWORD')
-        if not redis_password:
-            raise ValueError("❌ REDIS_PASSWORD environment variable not set")
-
-        is_docker = os.path.exists('/.dockerenv')
-        redis_host = 'host.docker.internal' if is_docker else config.get('host', '127.0.0.1')
-        redis_port = config.get('port', 6380)
-        redis_ssl = config.get('use_ssl', True)
-
-        # Redis connection parameters optimized for resilience
-        connection_kwargs = {
-            'host': redis_host,
-            'port': redis_port,
-            'password': redis_password,
-            'decode_responses': True,
-            'socket_keepalive': True,
-            'socket_connect_timeout': 5,
-            'socket_timeout': 5,
-            'retry_on_timeout': True,
-            'retry_on_error': [redis.exceptions.ConnectionError],
-            'max_connections': 10,  # Connection pool size
-        }
-
-        # Add SSL settings if enabled
-        if redis_ssl:
-            connection_kwargs.update({
-                'ssl': True,
-                'ssl_cert_reqs': None  # Don't verify SSL certificate
-            })
-
-        logger.info(f"🔌 Connecting to Redis at {redis_host}:{redis_port} (SSL: {redis_ssl})")
-        client = redis.Redis(**connection_kwargs)
+        pool = build_connection_pool(config)
+        redis_host = pool.connection_kwargs['host']
+        redis_port = pool.connection_kwargs['port']
+        redis_ssl = pool.connection_class is redis.SSLConnection
+
+        logger.info(f"🔌 Connecting to Redis at {redis_host}:{redis_port} "
+                    f"(SSL: {redis_ssl}, pool: {pool.max_connections})")
+        client = InstrumentedRedis.from_pool(pool)
 
         # Test connection with retry
         max_attempts = 3
@@ -72,6 +133,43 @@ def create_redis_client(config: dict) -> redis.Redis:
         raise
 
 
+async def create_async_redis_client(config: dict) -> redis_asyncio.Redis:
+    """
+    Create an asyncio Redis client with the same settings as create_redis_client.
+    """
+    try:
+        pool = build_connection_pool(config, use_asyncio=True)
+        logger.info(f"🔌 Connecting to Redis (asyncio) at {pool.connection_kwargs['host']}:{pool.connection_kwargs['port']} "
+                    f"(pool: {pool.max_connections})")
+        client = AsyncInstrumentedRedis.from_pool(pool)
+
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            try:
+                await client.ping()
+                logger.info("✅ Successfully connected to Redis (asyncio)")
+                return client
+            except redis.ConnectionError as e:
+                if attempt == max_attempts - 1:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Redis connection attempt {attempt + 1} failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+
+    except Exception as e:
+        logger.error(f"❌ Unexpected error creating asyncio Redis client: {e}", exc_info=True)
+        raise
+
+
+def create_service_client(config: dict) -> WebPubSubServiceClient:
+    """
+    Create the Web PubSub service client the asyncio runtime's delivery scheduler replies with.
+    """
+    connection_string = config['connection_string'].strip().strip('"').strip("'")
+    hub_name = config['hub_name'].strip().strip('"').strip("'")
+    return WebPubSubServiceClient.from_connection_string(connection_string, hub=hub_name)
+
+
 def create_pubsub_client(config: dict) -> Tuple[WebPubSubServiceClient, WebPubSubClient]:
     """
     Create WebPubSub clients with messaging-specific retry logic.
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# content_importer.py
+"""
+Import world content from a directory of markdown files into Redis.
+
+Each file becomes one navigation document. Files are split into sections at
+top-level headings (see mardown-data-format.md), and only files whose content
+hash changed since the last import are uploaded.
+
+    city/asko_norge.md  ->  woa.world.navigation.city.markdown.asko_norge
+"""
+
+import os
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, List, Tuple
+import redis
+from connection_manager import create_redis_client, load_ssl_config_from_env
+from cache_invalidation import publish_invalidation
+from navigation_core import list_payload_keys, create_live_version_key
+from link_graph import list_link_index_keys
+from reference_index import queue_stale_section_removal, find_broken_references
+from sample_content import create_navigation_key, create_metadata_key, create_section_prefix, queue_navigation_sections
+from section_store import queue_document_removal, collect_garbage, DEFAULT_GC_GRACE
+from version_store import queue_version_removal
+
+logger = logging.getLogger(__name__)
+
+IMPORT_HASHES_KEY = "woa.world.import.hashes"
+IMPORT_BATCH_SIZE = 200
+CODE_FENCES = ("```", "~~~")
+
+
+def split_sections(markdown: str) -> List[str]:
+    """
+    Split a document into sections at top-level (# ) headings.
+
+    Headings inside fenced code blocks are ignored, and any text before the
+    first heading is kept as its own leading section.
+    """
+    sections: List[List[str]] = [[]]
+    in_code_block = False
+
+    for line in markdown.splitlines():
+        if line.lstrip().startswith(CODE_FENCES):
+            in_code_block = not in_code_block
+        elif not in_code_block and line.startswith("# "):
+            sections.append([])
+        sections[-1].append(line)
+
+    joined = ("\n".join(lines).strip() for lines in sections)
+    return [section for section in joined if section]
+
+
+def path_to_nav_key(relative_path: Path) -> str:
+    """Map city/asko_norge.md to woa.world.navigation.city.markdown.asko_norge"""
+    parts = list(relative_path.with_suffix("").parts)
+    name = parts.pop()
+    return create_navigation_key(".".join([*parts, "markdown", name]))
+
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def scan_directory(root: Path) -> Dict[str, Tuple[str, str]]:
+    """Return {nav_key: (content, hash)} for every markdown file under root"""
+    documents = {}
+    for path in sorted(root.rglob("*.md")):
+        if not path.is_file():
+            continue
+        content = path.read_text(encoding="utf-8")
+        nav_key = path_to_nav_key(path.relative_to(root))
+        if nav_key in documents:
+            logger.warning(f"⚠️ {path} maps to {nav_key}, which is already imported from another file; skipping")
+            continue
+        documents[nav_key] = (content, hash_content(content))
+    return documents
+
+
+def import_directory(redis_client: redis.Redis,
+                     root: Path,
+                     prune: bool = False,
+                     dry_run: bool = False,
+                     gc_grace: float = DEFAULT_GC_GRACE) -> Dict[str, int]:
+    """
+    Upload changed documents under root and optionally remove documents whose files are gone.
+    Returns counts of unchanged, uploaded and removed documents and of collected section blobs.
+    """
+    documents = scan_directory(root)
+    stored_hashes = redis_client.hgetall(IMPORT_HASHES_KEY)
+
+    changed = [nav_key for nav_key, (_, digest) in documents.items() if stored_hashes.get(nav_key) != digest]
+    removed = [nav_key for nav_key in stored_hashes if nav_key not in documents] if prune else []
+    stats = {"unchanged": len(documents) - len(changed), "uploaded": len(changed), "removed": len(removed)}
+
+    if dry_run:
+        for nav_key in changed:
+            logger.info(f"Would upload {nav_key}")
+        for nav_key in removed:
+            logger.info(f"Would remove {nav_key}")
+        return stats
+
+    for start in range(0, len(changed), IMPORT_BATCH_SIZE):
+        batch = changed[start:start + IMPORT_BATCH_SIZE]
+        pipe = redis_client.pipeline(transaction=True)
+        written_keys = []
+        for nav_key in batch:
+            content, digest = documents[nav_key]
+            sections = split_sections(content) or [content]
+            keys = queue_navigation_sections(pipe, nav_key, sections)
+            pipe.hset(IMPORT_HASHES_KEY, nav_key, digest)
+            written_keys.extend(keys)
+        pipe.execute()
+        publish_invalidation(redis_client, written_keys)
+        logger.info(f"Uploaded {start + len(batch)}/{len(changed)} changed documents")
+
+    if removed:
+        pipe = redis_client.pipeline(transaction=True)
+        deleted_keys = []
+        for nav_key in removed:
+            metadata_key = create_metadata_key(nav_key)
+            keys = [*list_payload_keys(nav_key), *list_link_index_keys(nav_key), create_live_version_key(nav_key)]
+            # Reads the section count from the metadata, so it goes ahead of the removal
+            queue_stale_section_removal(pipe, metadata_key, nav_key, create_section_prefix(nav_key), 0)
+            queue_document_removal(pipe, metadata_key)
+            # Manifests hold blob references too; without this the blobs are never collected
+            queue_version_removal(pipe, nav_key)
+            pipe.delete(*keys)
+            pipe.hdel(IMPORT_HASHES_KEY, nav_key)
+            deleted_keys.extend([metadata_key, *keys])
+        pipe.execute()
+        publish_invalidation(redis_client, deleted_keys)
+        logger.info(f"Removed {len(removed)} documents no longer on disk")
+
+    # Blobs released by earlier imports that are still unreferenced after the grace period
+    stats["collected"] = collect_garbage(redis_client, gc_grace)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Import markdown world content into Redis navigation keys'
+    )
+    parser.add_argument('directory', help='Directory of markdown files to import')
+    parser.add_argument(
+        '--host',
+        default=os.environ.get('REDIS_HOST', '127.0.0.1'),
+        help='Redis host (default: $REDIS_HOST or 127.0.0.1)'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=int(os.environ.get('REDIS_PORT', '6380')),
+        help='Redis port (default: $REDIS_PORT or 6380)'
+    )
+    parser.add_argument(
+        '--no-ssl',
+        action='store_true',
+        help='Connect without TLS (local redis-server)'
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='Delete previously imported documents whose files no longer exist'
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Show what would change without writing'
+    )
+    parser.add_argument(
+        '--gc-grace',
+        type=float,
+        default=DEFAULT_GC_GRACE,
+        help=f'Seconds a section blob must stay unreferenced before it is deleted (default: {DEFAULT_GC_GRACE:g})'
+    )
+    parser.add_argument(
+        '--check-links',
+        action='store_true',
+        help='After importing, report links and [[doc:...]] references whose target does not exist'
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    redis_client = create_redis_client({"host": args.host, "port": args.port, "use_ssl": not args.no_ssl,
+                                        **load_ssl_config_from_env()})
+    try:
+        stats = import_directory(redis_client, Path(args.directory), prune=args.prune, dry_run=args.dry_run,
+                                 gc_grace=args.gc_grace)
+        print(f"\nImport Summary:")
+        print(f"Uploaded: {stats['uploaded']:,}")
+        print(f"Unchanged: {stats['unchanged']:,}")
+        print(f"Removed: {stats['removed']:,}")
+        print(f"Collected blobs: {stats.get('collected', 0):,}")
+
+        if args.check_links:
+            broken = find_broken_references(redis_client)
+            print(f"\nBroken references: {len(broken):,}")
+            for target, referrers in broken.items():
+                print(f"  {target}")
+                for section_key in referrers:
+                    print(f"    <- {section_key}")
+    finally:
+        redis_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,136 +1,140 @@
 # content_manager.py
-import json
 import logging
-import time
-import uuid
-from typing import Dict, List, Optional
+from typing import Any, List, Optional, Tuple, Union
 import redis
+from redis.client import NEVER_DECODE
 from azure.messaging.webpubsubservice import WebPubSubServiceClient
-from azure.messaging.webpubsubclient.models import SendMessageError
+from navigation_cache import NavigationCache
+from redis_scripts import assemble_document
+from version_store import get_version_sections
+from delivery import DeliveryScheduler, Recipient, deliver_response
+from presence import PresenceIndex
+from singleflight import SingleFlight, DuplicateFilter
+from event_sink import EventSink, build_system_event, queue_system_events
+from navigation_core import Steps, navigation_steps, connect_batch_steps, disconnect_steps
+
+# The threaded runtime's I/O layer. What to read and send is decided by the steps in
+# navigation_core; RedisPort performs each operation they yield with blocking clients.
 
 logger = logging.getLogger(__name__)
 
-MAX_DELIVERY_ATTEMPTS = 3
-ROOT_NAV_KEY = "woa.world.navigation.main.markdown.root"
 
+class RedisPort:
+    """Performs navigation_core operations with the sync Redis and Web PubSub clients"""
 
-def store_system_event(redis_client: redis.Redis, event_type: str, connection_id: str, data: dict) -> None:
-    """Store system events with TTL"""
-    try:
-        event_key = f"woa.system.events.{event_type}.{connection_id}"
-        event_data = {
-            "timestamp": time.time(),
-            "connection_id": connection_id,
-            **data
-        }
-        # Store event with 24h TTL
-        redis_client.setex(event_key, 86400, json.dumps(event_data))
-        logger.info(f"Stored system event: {event_type} for connection {connection_id}")
-    except Exception as e:
-        logger.error(f"Failed to store system event: {e}", exc_info=True)
+    def __init__(self,
+                 redis_client: redis.Redis,
+                 pubsub_service: Optional[WebPubSubServiceClient] = None,
+                 delivery: Optional[DeliveryScheduler] = None,
+                 events: Optional[EventSink] = None,
+                 presence: Optional[PresenceIndex] = None,
+                 flights: Optional[SingleFlight] = None):
+        self.redis_client = redis_client
+        self.pubsub_service = pubsub_service
+        self.delivery = delivery
+        self.events = events
+        self.presence = presence
+        self.flights = flights
 
+    def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return self.redis_client.mget(keys)
 
-def get_navigation_content(redis_client: redis.Redis, nav_key: str = ROOT_NAV_KEY) -> Optional[str]:
-    """Get navigation content without using wildcards"""
-    try:
-        metadata_key = f"{nav_key}.metadata"
-        metadata = redis_client.get(metadata_key)
+    def mget_raw(self, keys: List[str]) -> List[Optional[bytes]]:
+        return self.redis_client.execute_command('MGET', *keys, **{NEVER_DECODE: True})
 
-        if not metadata:
-            return None
+    def assemble_document(self, metadata_key: str):
+        return assemble_document(self.redis_client, metadata_key)
 
-        section_keys = json.loads(metadata)
-        sections = []
+    def read_version(self, nav_key: str, version: str):
+        return get_version_sections(self.redis_client, nav_key, version)
 
-        for section_key in section_keys:
-            content = redis_client.get(section_key)
-            if content:
-                sections.append(content)
+    def page_presence(self, nav_key: str):
+        return self.presence.page_presence(nav_key)
 
-        return "\n\n".join(sections) if sections else None
-    except Exception as e:
-        logger.error(f"Failed to get navigation content: {e}", exc_info=True)
-        return None
+    def touch_presence(self, entries: List[Tuple[str, Optional[str], Optional[str]]]) -> None:
+        self.presence.touch(entries)
 
+    def leave_presence(self, connection_ids: List[str]) -> None:
+        self.presence.leave(connection_ids)
 
-def handle_navigation_event(redis_client: redis.Redis,
-                            pubsub_service: WebPubSubServiceClient,
-                            content: str,
-                            connection_id: str) -> None:
-    """Handle navigation events with retry logic"""
-    try:
-        message = json.loads(content)
-        if not all(key in message for key in ['type', 'filename']):
-            logger.error("Invalid navigation event format")
-            return
-
-        nav_key = message['filename']
-        content = get_navigation_content(redis_client, nav_key)
+    def deliver(self, recipient: Recipient, response: Union[str, bytes], label: str) -> None:
+        deliver_response(self.pubsub_service, recipient, response, self.delivery, label)
 
-        if not content:
-            logger.warning(f"No content found for {nav_key}")
+    def record_events(self, event_type: str, events: List[Tuple[str, dict]]) -> None:
+        """Buffer through the event sink when there is one, otherwise write in one pipeline"""
+        if self.events:
+            for connection_id, data in events:
+                self.events.record(event_type, connection_id, data)
             return
+        pipe = self.redis_client.pipeline(transaction=False)
+        queue_system_events(pipe, [build_system_event(event_type, connection_id, data) for connection_id, data in events])
+        pipe.execute()
+        logger.info(f"Stored {len(events)} system event(s): {event_type}")
+
+    def shared(self, key, steps: Steps) -> Any:
+        """Run steps once for all concurrent requests of the same key"""
+        if self.flights:
+            return self.flights.do(key, lambda: drive(steps, self))
+        return drive(steps, self)
+
+
+def drive(steps: Steps, port: RedisPort) -> Any:
+    """Run navigation_core steps to completion, performing each operation on port"""
+    result, error = None, None
+    while True:
+        try:
+            operation = steps.throw(error) if error else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        name, *args = operation
+        try:
+            result, error = getattr(port, name)(*args), None
+        except Exception as e:
+            result, error = None, e
+
 
-        for attempt in range(MAX_DELIVERY_ATTEMPTS):
-            try:
-                response = {
-                    "type": "markdown_content",
-                    "filename": nav_key,
-                    "content": content
-                }
-                pubsub_service.send_to_connection(connection_id, json.dumps(response))
-                logger.info(f"Sent navigation response for {nav_key}")
-                break
-            except SendMessageError as e:
-                if attempt == MAX_DELIVERY_ATTEMPTS - 1:
-                    raise
-                delay = 1 * (2 ** attempt)
-                logger.warning(f"Message delivery attempt {attempt + 1} failed, retrying in {delay}s: {e}")
-                time.sleep(delay)
-
-    except Exception as e:
-        logger.error(f"Error in handle_navigation_event: {e}", exc_info=True)
+def handle_navigation_event(redis_client: redis.Redis,
+                            pubsub_service: WebPubSubServiceClient,
+                            content: str,
+                            sender: Recipient,
+                            cache: Optional[NavigationCache] = None,
+                            delivery: Optional[DeliveryScheduler] = None,
+                            presence: Optional[PresenceIndex] = None,
+                            flights: Optional[SingleFlight] = None,
+                            duplicates: Optional[DuplicateFilter] = None,
+                            prefetch_hints: int = 0) -> None:
+    """Handle navigation events; failed sends are retried by the delivery scheduler"""
+    port = RedisPort(redis_client, pubsub_service, delivery=delivery, presence=presence, flights=flights)
+    drive(navigation_steps(content, sender, cache, duplicates, presence is not None, prefetch_hints), port)
+
+
+def handle_connect_batch(redis_client: redis.Redis,
+                         pubsub_service: WebPubSubServiceClient,
+                         connections: List[Tuple[str, dict]],
+                         cache: Optional[NavigationCache] = None,
+                         delivery: Optional[DeliveryScheduler] = None,
+                         events: Optional[EventSink] = None,
+                         presence: Optional[PresenceIndex] = None) -> None:
+    """Handle a burst of client connections: fetch the root document once and fan it out"""
+    port = RedisPort(redis_client, pubsub_service, delivery=delivery, events=events, presence=presence)
+    drive(connect_batch_steps(connections, cache, presence is not None), port)
 
 
 def handle_connect_event(redis_client: redis.Redis,
                          pubsub_service: WebPubSubServiceClient,
                          connection_id: str,
-                         user_data: Optional[dict] = None) -> None:
+                         user_data: Optional[dict] = None,
+                         cache: Optional[NavigationCache] = None,
+                         delivery: Optional[DeliveryScheduler] = None,
+                         events: Optional[EventSink] = None,
+                         presence: Optional[PresenceIndex] = None) -> None:
     """Handle client connection with initial navigation load"""
-    try:
-        # Store connection event
-        store_system_event(redis_client, "connect", connection_id, user_data or {})
-
-        # Get root navigation content
-        content = get_navigation_content(redis_client)
+    handle_connect_batch(redis_client, pubsub_service, [(connection_id, user_data or {})], cache, delivery, events, presence)
 
-        if not content:
-            logger.error("Failed to get root navigation content")
-            return
 
-        for attempt in range(MAX_DELIVERY_ATTEMPTS):
-            try:
-                response = {
-                    "type": "initial_navigation",
-                    "content": content
-                }
-                pubsub_service.send_to_connection(connection_id, json.dumps(response))
-                logger.info("Sent initial navigation content")
-                break
-            except SendMessageError as e:
-                if attempt == MAX_DELIVERY_ATTEMPTS - 1:
-                    raise
-                delay = 1 * (2 ** attempt)
-                logger.warning(f"Connect message delivery attempt {attempt + 1} failed, retrying in {delay}s: {e}")
-                time.sleep(delay)
-
-    except Exception as e:
-        logger.error(f"Error in handle_connect_event: {e}", exc_info=True)
-
-
-def handle_disconnect_event(redis_client: redis.Redis, connection_id: str) -> None:
+def handle_disconnect_event(redis_client: redis.Redis,
+                            connection_id: str,
+                            events: Optional[EventSink] = None,
+                            presence: Optional[PresenceIndex] = None) -> None:
     """Handle client disconnection"""
-    try:
-        store_system_event(redis_client, "disconnect", connection_id, {})
-    except Exception as e:
-        logger.error(f"Error in handle_disconnect_event: {e}", exc_info=True)
\ No newline at end of file
+    drive(disconnect_steps(connection_id, presence is not None), RedisPort(redis_client, events=events, presence=presence))
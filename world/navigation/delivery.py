@@ -0,0 +1,248 @@
+# delivery.py
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple, Union
+from azure.core.exceptions import AzureError
+from azure.messaging.webpubsubservice import WebPubSubServiceClient
+from wire_format import content_type_for
+from metrics import DELIVERY_ATTEMPTS
+from event_sink import EventSink, DEAD_LETTER_STREAM
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BASE_DELAY = 1.0
+DEFAULT_DELIVERY_WORKERS = 4
+
+RECIPIENT_CONNECTION = "connection"
+RECIPIENT_USER = "user"
+
+
+@dataclass(frozen=True)
+class Recipient:
+    """
+    Where a reply goes: one connection, or every connection of a user.
+
+    Connect events name a connection, but group messages only carry the sender's
+    user id, so replies to them are sent to the user. Keeping the kind with the
+    id means a user id is never sent to as if it were a connection id.
+    """
+    kind: str
+    id: str
+
+    @property
+    def key(self) -> str:
+        """Per-sender key for rate limit buckets, partitioning and task queues"""
+        return f"{self.kind}.{self.id}"
+
+    @property
+    def user_id(self) -> Optional[str]:
+        """The user id Web PubSub authenticated the sender as, when the recipient is a user"""
+        return self.id if self.kind == RECIPIENT_USER else None
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.id}"
+
+
+def to_connection(connection_id: str) -> Recipient:
+    return Recipient(RECIPIENT_CONNECTION, connection_id)
+
+
+def to_user(user_id: str) -> Recipient:
+    return Recipient(RECIPIENT_USER, user_id)
+
+
+def send_to_recipient(pubsub_service: WebPubSubServiceClient, recipient: Recipient, payload: Union[str, bytes]) -> None:
+    """One send, to the connection or to all of the user's connections"""
+    if recipient.kind == RECIPIENT_USER:
+        pubsub_service.send_to_user(recipient.id, payload, content_type=content_type_for(payload))
+    else:
+        pubsub_service.send_to_connection(recipient.id, payload, content_type=content_type_for(payload))
+
+
+@dataclass
+class Delivery:
+    pubsub_service: WebPubSubServiceClient
+    recipient: Recipient
+    payload: Union[str, bytes]
+    label: str
+    attempts: int = 0
+    last_error: str = ""
+
+
+def build_dead_letter(delivery: Delivery) -> dict:
+    """Data of the stream entry kept for a message that could not be delivered"""
+    return {
+        "recipient": delivery.recipient.kind,
+        "label": delivery.label,
+        "attempts": delivery.attempts,
+        "error": delivery.last_error,
+        "content_type": content_type_for(delivery.payload),
+        "size": len(delivery.payload),
+    }
+
+
+class DeliveryScheduler:
+    """
+    Sends replies from a small worker pool and retries failures from a delay queue.
+
+    Callback threads only enqueue; a failed send is parked on a heap until its
+    backoff expires instead of sleeping in the thread that received the event.
+    Messages to one recipient are sent one at a time in the order they were
+    queued, so a retrying reply is never overtaken by a later one. After
+    max_attempts the message is recorded in DEAD_LETTER_STREAM through the
+    event sink and the recipient's next message goes out.
+    """
+
+    def __init__(self,
+                 events: Optional[EventSink] = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+                 workers: int = DEFAULT_DELIVERY_WORKERS):
+        self.events = events
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.worker_count = workers
+        self._pending: Dict[Recipient, Deque[Delivery]] = {}
+        self._ready: "queue.Queue[Optional[Recipient]]" = queue.Queue()
+        self._delayed: List[Tuple[float, int, Recipient]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._timer_wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self._threads = [threading.Thread(target=self._run_timer, name="delivery-timer", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._run_worker, name=f"delivery-worker-{i}", daemon=True)
+            for i in range(self.worker_count)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Give queued sends up to `timeout` seconds to finish, then stop the threads"""
+        deadline = time.monotonic() + timeout
+        while self.pending_count() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        with self._lock:
+            self._stopping = True
+            self._timer_wakeup.notify()
+            dropped = sum(len(messages) for messages in self._pending.values())
+        for _ in range(self.worker_count):
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        if dropped:
+            logger.warning(f"⚠️ Delivery scheduler stopped with {dropped} undelivered message(s)")
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(messages) for messages in self._pending.values())
+
+    def send(self,
+             pubsub_service: WebPubSubServiceClient,
+             recipient: Recipient,
+             payload: Union[str, bytes],
+             label: str = "") -> None:
+        """Queue a message for a recipient; returns immediately"""
+        delivery = Delivery(pubsub_service, recipient, payload, label)
+        with self._lock:
+            messages = self._pending.get(recipient)
+            if messages:
+                # Earlier message still in flight or waiting to retry; keep order
+                messages.append(delivery)
+                return
+            self._pending[recipient] = deque([delivery])
+        self._ready.put(recipient)
+
+    def _run_worker(self) -> None:
+        while True:
+            recipient = self._ready.get()
+            if recipient is None:
+                return
+            with self._lock:
+                messages = self._pending.get(recipient)
+                delivery = messages[0] if messages else None
+            if delivery:
+                self._attempt(delivery)
+
+    def _attempt(self, delivery: Delivery) -> None:
+        delivery.attempts += 1
+        try:
+            send_to_recipient(delivery.pubsub_service, delivery.recipient, delivery.payload)
+            DELIVERY_ATTEMPTS.labels('sent').inc()
+            logger.info(f"Sent {delivery.label or 'message'} to {delivery.recipient}")
+        except AzureError as e:
+            delivery.last_error = str(e)
+            if delivery.attempts < self.max_attempts:
+                DELIVERY_ATTEMPTS.labels('retry').inc()
+                delay = self.base_delay * (2 ** (delivery.attempts - 1))
+                logger.warning(f"Delivery attempt {delivery.attempts} to {delivery.recipient} failed, "
+                               f"retrying in {delay}s: {e}")
+                self._schedule_retry(delivery.recipient, delay)
+                return
+            logger.error(f"Giving up on {delivery.label or 'message'} to {delivery.recipient} "
+                         f"after {delivery.attempts} attempts: {e}")
+            self._dead_letter(delivery)
+        except Exception as e:
+            delivery.last_error = str(e)
+            logger.error(f"Unexpected error delivering to {delivery.recipient}: {e}", exc_info=True)
+            self._dead_letter(delivery)
+        self._advance(delivery.recipient)
+
+    def _advance(self, recipient: Recipient) -> None:
+        """Drop the recipient's head message and hand the next one to a worker"""
+        with self._lock:
+            messages = self._pending.get(recipient)
+            if messages:
+                messages.popleft()
+            if not messages:
+                self._pending.pop(recipient, None)
+                return
+        self._ready.put(recipient)
+
+    def _schedule_retry(self, recipient: Recipient, delay: float) -> None:
+        with self._lock:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), recipient))
+            self._timer_wakeup.notify()
+
+    def _run_timer(self) -> None:
+        with self._lock:
+            while not self._stopping:
+                if not self._delayed:
+                    self._timer_wakeup.wait()
+                    continue
+                due, _, recipient = self._delayed[0]
+                remaining = due - time.monotonic()
+                if remaining > 0:
+                    self._timer_wakeup.wait(timeout=remaining)
+                    continue
+                heapq.heappop(self._delayed)
+                self._ready.put(recipient)
+
+    def _dead_letter(self, delivery: Delivery) -> None:
+        DELIVERY_ATTEMPTS.labels('dead_letter').inc()
+        if self.events:
+            self.events.record("dead_letter", delivery.recipient.id, build_dead_letter(delivery), DEAD_LETTER_STREAM)
+
+
+def deliver_response(pubsub_service: WebPubSubServiceClient,
+                     recipient: Recipient,
+                     response: Union[str, bytes],
+                     delivery: Optional[DeliveryScheduler] = None,
+                     label: str = "") -> None:
+    """Hand a reply to the delivery scheduler, or send it once inline when there is none"""
+    if delivery:
+        delivery.send(pubsub_service, recipient, response, label)
+    else:
+        send_to_recipient(pubsub_service, recipient, response)
+        DELIVERY_ATTEMPTS.labels('sent').inc()
@@ -118,6 +118,9 @@ REDIS_HOST=127.0.0.1
 REDIS_PORT=$LOCAL_REDIS_PORT
 REDIS_PASSWORD=$redis_key
 REDIS_SSL=true
+# The tunnel (and host.docker.internal in Docker) does not match the certificate's
+# host name; the certificate chain is still verified
+REDIS_SSL_CHECK_HOSTNAME=false
 
 # Container Registry
 ACR_SERVER=${ACR_NAME}.azurecr.io
@@ -0,0 +1,115 @@
+# event_sink.py
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import redis
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_EVENT_STREAM = "woa.system.events"
+# Replies the delivery scheduler gave up on; capped on its own so connect bursts never push them out
+DEAD_LETTER_STREAM = "woa.system.deadletters"
+# Approximate trimming (MAXLEN ~) lets Redis drop whole stream nodes, which is far cheaper than exact trimming
+SYSTEM_EVENT_STREAM_MAXLEN = 100000
+DEAD_LETTER_STREAM_MAXLEN = 10000
+STREAM_MAXLEN = {SYSTEM_EVENT_STREAM: SYSTEM_EVENT_STREAM_MAXLEN, DEAD_LETTER_STREAM: DEAD_LETTER_STREAM_MAXLEN}
+DEFAULT_EVENT_BATCH_SIZE = 100
+DEFAULT_EVENT_FLUSH_INTERVAL = 1.0
+MAX_BUFFERED_EVENTS = 10000
+
+
+def build_system_event(event_type: str, connection_id: str, data: dict) -> Dict[str, str]:
+    """Build the stream entry of a system event"""
+    return {
+        "type": event_type,
+        "connection_id": connection_id,
+        "timestamp": str(time.time()),
+        "data": json.dumps(data),
+    }
+
+
+def queue_system_events(pipe, entries: List[Dict[str, str]], stream: str = SYSTEM_EVENT_STREAM) -> None:
+    """Queue XADDs for a batch of entries on a pipeline (sync or asyncio)"""
+    for entry in entries:
+        pipe.xadd(stream, entry, maxlen=STREAM_MAXLEN[stream], approximate=True)
+
+
+class EventSink:
+    """
+    Buffers connect/disconnect events and dead letters and writes them to their capped Redis Streams in batches.
+
+    Events are flushed when batch_size are buffered or every flush_interval
+    seconds, whichever comes first, and once more on stop. A failed flush keeps
+    its events for the next attempt; past MAX_BUFFERED_EVENTS the oldest are dropped.
+    """
+
+    def __init__(self,
+                 redis_client: redis.Redis,
+                 batch_size: int = DEFAULT_EVENT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_EVENT_FLUSH_INTERVAL):
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[Tuple[str, Dict[str, str]]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="event-sink", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self.flush()
+
+    def record(self,
+               event_type: str,
+               connection_id: str,
+               data: Optional[dict] = None,
+               stream: str = SYSTEM_EVENT_STREAM) -> None:
+        entry = build_system_event(event_type, connection_id, data or {})
+        with self._lock:
+            self._buffer.append((stream, entry))
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of events written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for stream, entry in batch:
+                    queue_system_events(pipe, [entry], stream)
+                pipe.execute()
+                logger.info(f"Flushed {len(batch)} system event(s)")
+                return len(batch)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} system event(s): {e}", exc_info=True)
+                self._requeue(batch)
+                return 0
+
+    def _requeue(self, batch: List[Tuple[str, Dict[str, str]]]) -> None:
+        with self._lock:
+            self._buffer = batch + self._buffer
+            overflow = len(self._buffer) - MAX_BUFFERED_EVENTS
+            if overflow > 0:
+                del self._buffer[:overflow]
+                logger.warning(f"⚠️ Dropped {overflow} buffered system event(s); Redis unavailable")
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
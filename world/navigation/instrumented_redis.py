@@ -0,0 +1,154 @@
+# instrumented_redis.py
+import time
+import weakref
+import threading
+import redis
+import redis.asyncio as redis_asyncio
+from redis.client import Pipeline
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from metrics import (
+    REDIS_POOL_CONNECTIONS,
+    REDIS_POOL_WAIT_SECONDS,
+    REDIS_POOL_TIMEOUTS,
+    REDIS_COMMAND_SECONDS,
+    REDIS_COMMAND_ERRORS,
+)
+
+POOL_EXHAUSTED_MESSAGE = "No connection available"
+
+
+def command_label(args) -> str:
+    return str(args[0]).upper() if args else "UNKNOWN"
+
+
+class _PoolMetricsMixin:
+    """Tracks checked-out and known connections so the pool can be exported as gauges"""
+
+    def _init_pool_metrics(self, metrics_label: str) -> None:
+        self.metrics_label = metrics_label
+        self._known_connections = weakref.WeakSet()
+        self._checked_out = weakref.WeakSet()
+        REDIS_POOL_CONNECTIONS.labels(metrics_label, 'in_use').set_function(lambda: len(self._checked_out))
+        REDIS_POOL_CONNECTIONS.labels(metrics_label, 'idle').set_function(
+            lambda: len(self._known_connections) - len(self._checked_out)
+        )
+        REDIS_POOL_CONNECTIONS.labels(metrics_label, 'max').set(self.max_connections)
+
+    def _record_checkout(self, connection, started: float) -> None:
+        REDIS_POOL_WAIT_SECONDS.labels(self.metrics_label).observe(time.perf_counter() - started)
+        self._known_connections.add(connection)
+        self._checked_out.add(connection)
+
+    def _record_failed_checkout(self, error: Exception, started: float) -> None:
+        REDIS_POOL_WAIT_SECONDS.labels(self.metrics_label).observe(time.perf_counter() - started)
+        if POOL_EXHAUSTED_MESSAGE in str(error):
+            REDIS_POOL_TIMEOUTS.labels(self.metrics_label).inc()
+
+
+class InstrumentedBlockingConnectionPool(_PoolMetricsMixin, redis.BlockingConnectionPool):
+    """BlockingConnectionPool that exports checkout waits and in-use/idle counts"""
+
+    def __init__(self, *args, metrics_label: str = "sync", **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self._init_pool_metrics(metrics_label)
+
+    def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            self._record_failed_checkout(e, started)
+            raise
+        with self._metrics_lock:
+            self._record_checkout(connection, started)
+        return connection
+
+    def release(self, connection) -> None:
+        with self._metrics_lock:
+            self._checked_out.discard(connection)
+        super().release(connection)
+
+
+class AsyncInstrumentedBlockingConnectionPool(_PoolMetricsMixin, redis_asyncio.BlockingConnectionPool):
+    """asyncio variant of InstrumentedBlockingConnectionPool"""
+
+    def __init__(self, *args, metrics_label: str = "asyncio", **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_pool_metrics(metrics_label)
+
+    async def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            self._record_failed_checkout(e, started)
+            raise
+        self._record_checkout(connection, started)
+        return connection
+
+    async def release(self, connection) -> None:
+        self._checked_out.discard(connection)
+        await super().release(connection)
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error: bool = True):
+        label = "MULTI" if self.transaction else "PIPELINE"
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(label).inc()
+            raise
+        finally:
+            REDIS_COMMAND_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that records the latency of every command it sends"""
+
+    def execute_command(self, *args, **options):
+        label = command_label(args)
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(label).inc()
+            raise
+        finally:
+            REDIS_COMMAND_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncInstrumentedPipeline(AsyncPipeline):
+    async def execute(self, raise_on_error: bool = True):
+        label = "MULTI" if self.is_transaction else "PIPELINE"
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(label).inc()
+            raise
+        finally:
+            REDIS_COMMAND_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+
+class AsyncInstrumentedRedis(redis_asyncio.Redis):
+    """asyncio variant of InstrumentedRedis"""
+
+    async def execute_command(self, *args, **options):
+        label = command_label(args)
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(label).inc()
+            raise
+        finally:
+            REDIS_COMMAND_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> AsyncInstrumentedPipeline:
+        return AsyncInstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
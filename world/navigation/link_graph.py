@@ -0,0 +1,71 @@
+# link_graph.py
+import re
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Off by default: every hint costs a Redis read and a second send per page view, and
+# the frontend does not consume prefetch_hints messages yet
+DEFAULT_PREFETCH_HINTS = 0
+PREFETCH_HINTS_MESSAGE = "prefetch_hints"
+# Markdown link targets such as (/woa.world.navigation.city.markdown.index)
+LINK_PATTERN = re.compile(r"\]\(/?(woa\.[\w.\-]+)\)")
+
+
+def create_links_key(nav_key: str) -> str:
+    """Key of the JSON list of documents a document links to"""
+    return f"{nav_key}.links"
+
+
+def create_digest_key(nav_key: str) -> str:
+    """Key of the content hash of a whole document"""
+    return f"{nav_key}.digest"
+
+
+def list_link_index_keys(nav_key: str) -> List[str]:
+    """Every derived key build_link_index writes for a document"""
+    return [create_links_key(nav_key), create_digest_key(nav_key)]
+
+
+def extract_links(nav_key: str, content: str) -> List[str]:
+    """Outgoing document links in order of first appearance, without self links"""
+    links = []
+    for target in LINK_PATTERN.findall(content):
+        if target != nav_key and target not in links:
+            links.append(target)
+    return links
+
+
+def hash_document(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def build_link_index(nav_key: str, content: str) -> Dict[str, str]:
+    """Link list and digest stored next to a document whenever it is written"""
+    return {
+        create_links_key(nav_key): json.dumps(extract_links(nav_key, content)),
+        create_digest_key(nav_key): hash_document(content),
+    }
+
+
+def parse_prefetch_hints(links: List[str], digests: List[Optional[str]], limit: int) -> List[Tuple[str, str]]:
+    """(nav_key, digest) of the first `limit` linked documents that exist"""
+    return [(target, digest) for target, digest in zip(links, digests) if digest][:limit]
+
+
+def build_prefetch_hints_response(nav_key: str, hints: List[Tuple[str, str]]) -> str:
+    """
+    Serialize the prefetch_hints message sent after a document.
+
+    Links are listed in page order, which is the order readers tend to follow
+    them; a client that already holds a document with the same digest can skip
+    fetching it.
+    """
+    return json.dumps({
+        "type": PREFETCH_HINTS_MESSAGE,
+        "filename": nav_key,
+        "documents": [{"filename": target, "digest": digest} for target, digest in hints]
+    })
@@ -1,20 +1,52 @@
 # main.py
 import os
+import asyncio
 import logging
-from azure.messaging.webpubsubclient import WebPubSubClient
-from azure.messaging.webpubsubclient.models import CallbackType, SendMessageError
-from connection_manager import create_redis_client, create_pubsub_client
+import threading
+from typing import Callable, Dict, List, Optional
+from azure.messaging.webpubsubservice import WebPubSubServiceClient
+from azure.messaging.webpubsubclient.models import CallbackType
+from connection_manager import (
+    create_redis_client,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_POOL_TIMEOUT,
+    DEFAULT_HEALTH_CHECK_INTERVAL,
+    load_ssl_config_from_env,
+)
 from sample_content import populate_initial_content
-from content_manager import handle_navigation_event, handle_connect_event, handle_disconnect_event
+from redis_scripts import register_scripts
+from navigation_cache import NavigationCache, DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_ENTRIES
+from cache_invalidation import CacheInvalidationListener
+from delivery import DeliveryScheduler
+from event_sink import EventSink
+from partitioning import create_partitioner, PARTITION_MODE_NONE
+from singleflight import SingleFlight, DuplicateFilter, DEFAULT_DUPLICATE_WINDOW
+from rate_limit import (
+    RateLimiter,
+    create_rate_limiter,
+    DEFAULT_CONNECTION_RATE,
+    DEFAULT_CONNECTION_BURST,
+    DEFAULT_GLOBAL_RATE,
+    DEFAULT_GLOBAL_BURST,
+)
+from metrics import DEFAULT_METRICS_PORT, start_metrics_server
+from presence import PresenceIndex, PresenceReaper, DEFAULT_PRESENCE_TTL
+from link_graph import DEFAULT_PREFETCH_HINTS
+from navigation_core import MAX_DELIVERY_ATTEMPTS
+from content_manager import handle_navigation_event, handle_connect_batch, handle_disconnect_event
+from admission import admit_message
+from connect_batcher import ConnectBatcher, DEFAULT_CONNECT_BATCH_WINDOW, DEFAULT_CONNECT_BATCH_SIZE
+from pubsub_runner import install_shutdown_handlers, run_pubsub_service
 from contextlib import contextmanager
 
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.environ.get('NAVIGATION_LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-logging.getLogger("websocket").setLevel(logging.DEBUG)
-logging.getLogger("azure").setLevel(logging.DEBUG)
+# SDK debug logging formats every frame and HTTP call; turn it on only when chasing a connection problem
+logging.getLogger("websocket").setLevel(os.environ.get('AZURE_LOG_LEVEL', 'WARNING').upper())
+logging.getLogger("azure").setLevel(os.environ.get('AZURE_LOG_LEVEL', 'WARNING').upper())
 
 
 def load_config_from_env():
@@ -24,12 +56,33 @@ def load_config_from_env():
             "host": os.environ['REDIS_HOST'],
             "port": int(os.environ.get('REDIS_PORT', '6380')),
             "use_managed_identity": os.environ.get('USE_MANAGED_IDENTITY', 'true').lower() == 'true',
+            "max_connections": int(os.environ.get('REDIS_MAX_CONNECTIONS', str(DEFAULT_MAX_CONNECTIONS))),
+            "pool_timeout": float(os.environ.get('REDIS_POOL_TIMEOUT', str(DEFAULT_POOL_TIMEOUT))),
+            "health_check_interval": int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', str(DEFAULT_HEALTH_CHECK_INTERVAL))),
+            **load_ssl_config_from_env(),
         }
         pubsub_config = {
             "connection_string": os.environ['AZURE_WEBPUBSUB_CONNECTION_STRING'],
             "hub_name": os.environ['AZURE_WEBPUBSUB_HUB_NAME'],
         }
-        return redis_config, pubsub_config
+        service_config = {
+            "cache_ttl": float(os.environ.get('NAVIGATION_CACHE_TTL', str(DEFAULT_CACHE_TTL))),
+            "cache_max_entries": int(os.environ.get('NAVIGATION_CACHE_MAX_ENTRIES', str(DEFAULT_CACHE_MAX_ENTRIES))),
+            "connect_batch_window": float(os.environ.get('NAVIGATION_CONNECT_BATCH_WINDOW', str(DEFAULT_CONNECT_BATCH_WINDOW))),
+            "connect_batch_size": int(os.environ.get('NAVIGATION_CONNECT_BATCH_SIZE', str(DEFAULT_CONNECT_BATCH_SIZE))),
+            "presence_ttl": float(os.environ.get('NAVIGATION_PRESENCE_TTL', str(DEFAULT_PRESENCE_TTL))),
+            "duplicate_window": float(os.environ.get('NAVIGATION_DUPLICATE_WINDOW', str(DEFAULT_DUPLICATE_WINDOW))),
+            "rate_limit": float(os.environ.get('NAVIGATION_RATE_LIMIT', str(DEFAULT_CONNECTION_RATE))),
+            "rate_burst": int(os.environ.get('NAVIGATION_RATE_BURST', str(DEFAULT_CONNECTION_BURST))),
+            "global_rate_limit": float(os.environ.get('NAVIGATION_GLOBAL_RATE_LIMIT', str(DEFAULT_GLOBAL_RATE))),
+            "global_rate_burst": int(os.environ.get('NAVIGATION_GLOBAL_RATE_BURST', str(DEFAULT_GLOBAL_BURST))),
+            "rate_limit_shared": os.environ.get('NAVIGATION_RATE_LIMIT_SHARED', 'false').lower() == 'true',
+            "metrics_port": int(os.environ.get('NAVIGATION_METRICS_PORT', str(DEFAULT_METRICS_PORT))),
+            "partition_mode": os.environ.get('NAVIGATION_PARTITION_MODE', PARTITION_MODE_NONE).lower(),
+            # Linked documents announced after each page for the client to prefetch; 0 (default) disables
+            "prefetch_hints": int(os.environ.get('NAVIGATION_PREFETCH_HINTS', str(DEFAULT_PREFETCH_HINTS))),
+        }
+        return redis_config, pubsub_config, service_config
     except KeyError as e:
         logger.error(f"Missing required environment variable: {e}")
         raise
@@ -46,6 +99,7 @@ def run_redis_service(config: dict):
         client = create_redis_client(config)
         if client:
             populate_initial_content(client)
+            register_scripts(client)
         yield client
     finally:
         if client:
@@ -53,79 +107,92 @@ def run_redis_service(config: dict):
             logger.info("Redis client closed")
 
 
-@contextmanager
-def run_pubsub_service(config: dict, redis_client=None):
-    """Run PubSub service and keep the WebSocket connection alive."""
-    pubsub_client = None
-    navigation_group = "navigation-events"
+def create_navigation_cache(config: dict) -> NavigationCache:
+    """Create the in-process document cache shared by all callbacks"""
+    return NavigationCache(ttl=config['cache_ttl'], max_entries=config['cache_max_entries'])
 
-    try:
-        service_client, pubsub_client = create_pubsub_client(config)
-
-        def on_connected(event):
-            """Handle connection events"""
-            logger.info(f"✅ Connected: {event.connection_id}")
-            handle_connect_event(
-                redis_client=redis_client,
-                pubsub_service=service_client,
-                connection_id=event.connection_id,
-                user_data=getattr(event, 'user_data', None)
-            )
 
-        def on_disconnected(event):
-            """Handle disconnection events"""
-            logger.warning(f"⚠️ Disconnected: {event.message}")
-            if redis_client:
-                handle_disconnect_event(
-                    redis_client=redis_client,
-                    connection_id=event.connection_id
-                )
+def create_connect_batcher(redis_client,
+                           service_client: WebPubSubServiceClient,
+                           cache: Optional[NavigationCache] = None,
+                           delivery: Optional[DeliveryScheduler] = None,
+                           events: Optional[EventSink] = None,
+                           presence: Optional[PresenceIndex] = None,
+                           window: float = DEFAULT_CONNECT_BATCH_WINDOW,
+                           max_batch: int = DEFAULT_CONNECT_BATCH_SIZE) -> ConnectBatcher:
+    """Batch initial navigation for one WebPubSub session; the caller stops it when the session ends"""
+    return ConnectBatcher(
+        lambda connections: handle_connect_batch(
+            redis_client=redis_client,
+            pubsub_service=service_client,
+            connections=connections,
+            cache=cache,
+            delivery=delivery,
+            events=events,
+            presence=presence
+        ),
+        window=window,
+        max_batch=max_batch
+    )
 
-        def on_message(event):
-            """Handles incoming group messages"""
-            if redis_client:
-                handle_navigation_event(
-                    redis_client=redis_client,
-                    pubsub_service=service_client,
-                    content=event.data,
-                    connection_id=event.connection_id
-                )
 
-        # Set up event handlers
-        pubsub_client.subscribe(CallbackType.CONNECTED, on_connected)
-        pubsub_client.subscribe(CallbackType.DISCONNECTED, on_disconnected)
-        pubsub_client.subscribe(CallbackType.GROUP_MESSAGE, on_message)
-        pubsub_client.subscribe(CallbackType.SERVER_MESSAGE,
-                              lambda e: logger.info(f"🔵 Server message: {e.data}"))
+def create_navigation_callbacks(redis_client,
+                                service_client: WebPubSubServiceClient,
+                                cache: Optional[NavigationCache] = None,
+                                delivery: Optional[DeliveryScheduler] = None,
+                                events: Optional[EventSink] = None,
+                                presence: Optional[PresenceIndex] = None,
+                                partitioner=None,
+                                flights: Optional[SingleFlight] = None,
+                                duplicates: Optional[DuplicateFilter] = None,
+                                rate_limiter: Optional[RateLimiter] = None,
+                                prefetch_hints: int = 0,
+                                connect_batcher: Optional[ConnectBatcher] = None) -> Dict[CallbackType, Callable]:
+    """Build the synchronous navigation callbacks for one WebPubSub session"""
+    def on_connected(event):
+        """Handle connection events"""
+        logger.info(f"✅ Connected: {event.connection_id}")
+        user_data = getattr(event, 'user_data', None)
+        if connect_batcher:
+            connect_batcher.submit(event.connection_id, user_data)
+        elif redis_client:
+            handle_connect_batch(redis_client, service_client, [(event.connection_id, user_data or {})],
+                                 cache, delivery, events, presence)
 
-        with pubsub_client:  # Keeps the connection open
-            logger.info("🔗 WebPubSub client connection established")
+    def on_disconnected(event):
+        """Handle disconnection events"""
+        logger.warning(f"⚠️ Disconnected: {event.message}")
+        if redis_client:
+            handle_disconnect_event(
+                redis_client=redis_client,
+                connection_id=event.connection_id,
+                events=events,
+                presence=presence
+            )
 
-            # Join group
-            try:
-                pubsub_client.join_group(navigation_group)
-                logger.info(f"✅ Successfully joined group: {navigation_group}")
-            except SendMessageError as e:
-                logger.warning(f"⚠️ Initial join attempt failed, retrying...")
-                try:
-                    pubsub_client.join_group(navigation_group, ack_id=e.ack_id)
-                    logger.info(f"✅ Joined group after retry: {navigation_group}")
-                except Exception as retry_error:
-                    logger.error(f"❌ Failed to join group after retry: {retry_error}")
-                    raise
-            except Exception as e:
-                logger.error(f"❌ Failed to join group: {e}")
-                raise
-
-            logger.info("🟢 WebPubSub event loop is running...")
-
-            while pubsub_client.is_connected():
-                pass  # This ensures the process stays alive
+    def on_message(event):
+        """Handles incoming group messages"""
+        sender = admit_message(event, service_client, rate_limiter, partitioner, delivery)
+        if sender and redis_client:
+            handle_navigation_event(
+                redis_client=redis_client,
+                pubsub_service=service_client,
+                content=event.data,
+                sender=sender,
+                cache=cache,
+                delivery=delivery,
+                presence=presence,
+                flights=flights,
+                duplicates=duplicates,
+                prefetch_hints=prefetch_hints
+            )
 
-    finally:
-        if pubsub_client:
-            pubsub_client.close()
-            logger.info("🔌 WebPubSub client closed")
+    return {
+        CallbackType.CONNECTED: on_connected,
+        CallbackType.DISCONNECTED: on_disconnected,
+        CallbackType.GROUP_MESSAGE: on_message,
+        CallbackType.SERVER_MESSAGE: lambda e: logger.info(f"🔵 Server message: {e.data}"),
+    }
 
 
 def main():
@@ -133,14 +200,82 @@ def main():
     Main service orchestrator - each service runs independently
     and can be managed separately
     """
+    shutdown_event = threading.Event()
+    install_shutdown_handlers(shutdown_event)
+
     try:
-        redis_config, pubsub_config = load_config_from_env()
+        redis_config, pubsub_config, service_config = load_config_from_env()
+        cache = create_navigation_cache(service_config)
+
+        if os.environ.get('NAVIGATION_RUNTIME', 'threads').lower() == 'asyncio':
+            from async_main import run_async_service
+            asyncio.run(run_async_service(redis_config, pubsub_config, shutdown_event, cache, service_config))
+            return
 
         with run_redis_service(redis_config) as redis_client:
             logger.info("Redis service started")
+            invalidation_listener = CacheInvalidationListener(redis_client, cache)
+            invalidation_listener.start()
+            events = EventSink(redis_client)
+            events.start()
+            delivery = DeliveryScheduler(events, max_attempts=MAX_DELIVERY_ATTEMPTS)
+            delivery.start()
+            presence = PresenceIndex(redis_client, ttl=service_config['presence_ttl'])
+            presence_reaper = PresenceReaper(presence)
+            presence_reaper.start()
+            start_metrics_server(service_config['metrics_port'], cache, presence)
+            rate_limiter = create_rate_limiter(service_config, redis_client)
+            flights = SingleFlight()
+            duplicates = DuplicateFilter(window=service_config['duplicate_window'])
+            partitioner = create_partitioner(redis_client, service_config['partition_mode'])
+            if partitioner:
+                partitioner.start()
+
+            session_batchers: List[ConnectBatcher] = []
+
+            def create_session_callbacks(service_client: WebPubSubServiceClient) -> Dict[CallbackType, Callable]:
+                # A new session replaces a dropped one; flush what the old batcher still holds first
+                while session_batchers:
+                    session_batchers.pop().stop()
+                connect_batcher = create_connect_batcher(
+                    redis_client,
+                    service_client,
+                    cache,
+                    delivery=delivery,
+                    events=events,
+                    presence=presence,
+                    window=service_config['connect_batch_window'],
+                    max_batch=service_config['connect_batch_size']
+                )
+                session_batchers.append(connect_batcher)
+                return create_navigation_callbacks(
+                    redis_client,
+                    service_client,
+                    cache,
+                    delivery=delivery,
+                    events=events,
+                    presence=presence,
+                    partitioner=partitioner,
+                    flights=flights,
+                    duplicates=duplicates,
+                    rate_limiter=rate_limiter,
+                    prefetch_hints=service_config['prefetch_hints'],
+                    connect_batcher=connect_batcher
+                )
 
-            with run_pubsub_service(pubsub_config, redis_client) as pubsub_client:
+            try:
                 logger.info("✅ All services started successfully")
+                run_pubsub_service(pubsub_config, create_session_callbacks, shutdown_event)
+            finally:
+                if partitioner:
+                    partitioner.stop()
+                # Pending connects go out through the delivery scheduler, so flush them before it stops
+                for connect_batcher in session_batchers:
+                    connect_batcher.stop()
+                delivery.stop()
+                events.stop()
+                presence_reaper.stop()
+                invalidation_listener.stop()
 
     except Exception as e:
         logger.error(f"Application failed to start: {e}", exc_info=True)
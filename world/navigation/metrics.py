@@ -0,0 +1,116 @@
+# metrics.py
+import logging
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_PORT = 9100
+
+# Pool waits should be ~0; anything in the upper buckets means the pool is too small
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REDIS_COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+REDIS_POOL_CONNECTIONS = Gauge(
+    'navigation_redis_pool_connections',
+    'Redis pool connections by state (in_use, idle, max)',
+    ['client', 'state']
+)
+REDIS_POOL_WAIT_SECONDS = Histogram(
+    'navigation_redis_pool_wait_seconds',
+    'Time spent waiting to check a connection out of the Redis pool',
+    ['client'],
+    buckets=POOL_WAIT_BUCKETS
+)
+REDIS_POOL_TIMEOUTS = Counter(
+    'navigation_redis_pool_timeouts_total',
+    'Checkouts that gave up because every pooled connection stayed busy',
+    ['client']
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    'navigation_redis_command_seconds',
+    'Redis round-trip latency per command; pipelines are recorded as PIPELINE or MULTI',
+    ['command'],
+    buckets=REDIS_COMMAND_BUCKETS
+)
+REDIS_COMMAND_ERRORS = Counter(
+    'navigation_redis_command_errors_total',
+    'Redis commands that raised',
+    ['command']
+)
+
+HANDLER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Client-supplied type strings are mapped onto this set so a bad client cannot explode label cardinality
+KNOWN_MESSAGE_TYPES = {"requestFile", "requestMarkdown", "navigation_change", "heartbeat", "presence_query", "connect"}
+
+NAVIGATION_REQUESTS = Counter(
+    'navigation_requests_total',
+    'Navigation messages handled, by message type',
+    ['type']
+)
+NAVIGATION_HANDLE_SECONDS = Histogram(
+    'navigation_handle_seconds',
+    'Time from receiving a message to handing its reply to delivery',
+    ['type'],
+    buckets=HANDLER_BUCKETS
+)
+NAVIGATION_REJECTED = Counter(
+    'navigation_rejected_total',
+    'Messages dropped before handling',
+    ['reason']
+)
+DELIVERY_ATTEMPTS = Counter(
+    'navigation_delivery_attempts_total',
+    'Reply send outcomes: sent, retry or dead_letter',
+    ['outcome']
+)
+ACTIVE_CONNECTIONS = Gauge(
+    'navigation_active_connections',
+    'Connections with a presence heartbeat within the TTL'
+)
+
+
+def message_type_label(message_type) -> str:
+    return message_type if message_type in KNOWN_MESSAGE_TYPES else "other"
+
+
+class NavigationCacheCollector:
+    """Exports NavigationCache counters at scrape time instead of on every lookup"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        for name, help_text in (("hits", "Document cache hits"),
+                                ("misses", "Document cache misses"),
+                                ("evictions", "Document cache evictions")):
+            counter = CounterMetricFamily(f'navigation_cache_{name}', help_text)
+            counter.add_metric([], stats[name])
+            yield counter
+        size = GaugeMetricFamily('navigation_cache_entries', 'Documents currently cached')
+        size.add_metric([], stats["size"])
+        yield size
+        hit_rate = GaugeMetricFamily('navigation_cache_hit_rate', 'Hit rate since start')
+        hit_rate.add_metric([], stats["hit_rate"])
+        yield hit_rate
+
+
+def _online_count(presence) -> float:
+    try:
+        return presence.online_count()
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read active connections for metrics: {e}")
+        return float("nan")
+
+
+def start_metrics_server(port: int, cache=None, presence=None) -> None:
+    """Serve /metrics on port (0 disables); cache and presence are read at scrape time"""
+    if port <= 0:
+        return
+    if cache is not None:
+        REGISTRY.register(NavigationCacheCollector(cache))
+    if presence is not None:
+        ACTIVE_CONNECTIONS.set_function(lambda: _online_count(presence))
+    start_http_server(port)
+    logger.info(f"✅ Serving metrics on :{port}/metrics")
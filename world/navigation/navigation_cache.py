@@ -0,0 +1,126 @@
+# navigation_cache.py
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = 300.0
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+
+
+class NavigationCache:
+    """
+    Bounded in-process LRU cache with per-entry TTL.
+
+    Keys are nav_keys and values are assembled documents. Each entry can list
+    the Redis keys it was built from, so a change to any metadata or section key
+    evicts every document that depends on it. The cache is shared between
+    WebPubSub callback threads, so every operation takes a lock.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_CACHE_TTL, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._dependencies: Dict[str, Set[str]] = {}
+        self._dependents: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached value, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self,
+            key: str,
+            value: Any,
+            ttl: Optional[float] = None,
+            depends_on: Iterable[str] = (),
+            generation: Optional[int] = None) -> None:
+        """
+        Store a value, evicting the least recently used entries beyond max_entries.
+
+        Pass the generation read before fetching from Redis to skip the write
+        if an invalidation arrived while the fetch was in flight.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (expires_at, value)
+            dependencies = set(depends_on)
+            if dependencies:
+                self._dependencies[key] = dependencies
+                for redis_key in dependencies:
+                    self._dependents.setdefault(redis_key, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> bool:
+        """Drop one entry; returns True if it was cached"""
+        with self._lock:
+            return self._remove(key)
+
+    def invalidate_dependency(self, redis_key: str) -> int:
+        """Drop every entry built from redis_key, plus any entry cached under that key"""
+        with self._lock:
+            self.generation += 1
+            keys = set(self._dependents.get(redis_key, ()))
+            keys.add(redis_key)
+            return sum(1 for key in keys if self._remove(key))
+
+    def _remove(self, key: str) -> bool:
+        """Remove an entry and its dependency links; caller holds the lock"""
+        if self._entries.pop(key, None) is None:
+            return False
+        for redis_key in self._dependencies.pop(key, ()):
+            dependents = self._dependents.get(redis_key)
+            if dependents:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[redis_key]
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._dependencies.clear()
+            self._dependents.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,581 @@
+# navigation_core.py
+import json
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Generator, List, Optional, Tuple, Union
+from navigation_cache import NavigationCache
+from payload_codec import encode_payload, decode_payload
+from wire_format import ENCODING_JSON, ENCODING_PROTOBUF, negotiate_encoding, encode_markdown_message, encode_version_frame
+from presence import HEARTBEAT_MESSAGE, PRESENCE_QUERY_MESSAGE, parse_page_presence, user_id_from
+from singleflight import DuplicateFilter
+from delivery import Recipient, to_connection
+from section_store import BLOB_PREFIX
+from version_store import create_section_ids, create_version_key
+from redis_scripts import ScriptUnavailable
+from link_graph import create_links_key, create_digest_key, parse_prefetch_hints, build_prefetch_hints_response
+from metrics import NAVIGATION_REQUESTS, NAVIGATION_HANDLE_SECONDS, NAVIGATION_REJECTED, message_type_label
+
+# Everything here is shared by the threaded (content_manager.py) and asyncio
+# (async_content_manager.py) runtimes: keys, reply building, cache bookkeeping,
+# message routing and the handlers themselves.
+#
+# Handlers are written once as steps: generators that yield the I/O they need as
+# (operation, *args) tuples and receive the result back. Each runtime has a port
+# that performs the operations with its own clients, and a drive() loop that
+# feeds results in and throws errors back at the yield. Operations:
+#   ("mget", keys)                      -> values, decoded
+#   ("mget_raw", keys)                  -> values as bytes (compressed payloads)
+#   ("assemble_document", metadata_key) -> (section_keys, document) or None; may raise ScriptUnavailable
+#   ("read_version", nav_key, version)  -> (version, sections) or None
+#   ("page_presence", nav_key)          -> page presence script result
+#   ("touch_presence", entries)         -> heartbeats for (connection_id, user_id, nav_key)
+#   ("leave_presence", connection_ids)
+#   ("deliver", recipient, response, label)
+#   ("record_events", event_type, [(connection_id, data), ...])
+#   ("shared", key, steps)              -> result of steps, run once for concurrent callers
+
+Steps = Generator[tuple, Any, Any]
+
+logger = logging.getLogger(__name__)
+
+MAX_DELIVERY_ATTEMPTS = 3
+ROOT_NAV_KEY = "woa.world.navigation.main.markdown.root"
+
+# Routes of a parsed navigation message
+ROUTE_HEARTBEAT = "heartbeat"
+ROUTE_PRESENCE = "presence"
+ROUTE_DELTA = "delta"
+ROUTE_CONTENT = "content"
+ROUTE_SNAPSHOT = "snapshot"
+
+
+def create_payload_key(nav_key: str, message_type: str = "markdown_content", encoding: str = ENCODING_JSON) -> str:
+    """Key of the materialized response envelope for a document"""
+    if encoding == ENCODING_JSON:
+        return f"{nav_key}.payload.{message_type}"
+    return f"{nav_key}.payload.{message_type}.{encoding}"
+
+
+INITIAL_PAYLOAD_KEY = create_payload_key(ROOT_NAV_KEY, "initial_navigation")
+
+
+def create_metadata_key(nav_key: str) -> str:
+    return f"{nav_key}.metadata"
+
+
+def create_sections_cache_key(nav_key: str) -> str:
+    return f"{nav_key}.sections"
+
+
+def create_live_version_key(nav_key: str) -> str:
+    """Version id (v1, v2, ...) of the live document, written by version_store with each live write"""
+    return f"{nav_key}.version"
+
+
+def list_payload_keys(nav_key: str) -> List[str]:
+    """Every materialized payload key a document can have"""
+    keys = [create_payload_key(nav_key, encoding=encoding) for encoding in (ENCODING_JSON, ENCODING_PROTOBUF)]
+    if nav_key == ROOT_NAV_KEY:
+        keys.append(INITIAL_PAYLOAD_KEY)
+    return keys
+
+
+def parse_navigation_message(content: str) -> Optional[dict]:
+    """Parse an incoming navigation event, returning None if it is malformed"""
+    message = json.loads(content)
+    if not all(key in message for key in ['type', 'filename']):
+        logger.error("Invalid navigation event format")
+        return None
+    return message
+
+
+def build_navigation_response(nav_key: str,
+                              content: str,
+                              encoding: str = ENCODING_JSON,
+                              version: str = "") -> Union[str, bytes]:
+    """Serialize the markdown_content reply for a navigation request"""
+    if encoding == ENCODING_PROTOBUF:
+        return encode_markdown_message("markdown_content", content=content, filename=nav_key, version=version)
+    response = {
+        "type": "markdown_content",
+        "filename": nav_key,
+        "content": content
+    }
+    if version:
+        response["version"] = version
+    return json.dumps(response)
+
+
+def stamp_version(response: Union[str, bytes], version: Optional[str]) -> Union[str, bytes]:
+    """
+    Add the document version to a materialized markdown_content reply without re-serializing it.
+
+    Protobuf merges concatenated messages, so a trailing version-only frame sets
+    the field; JSON envelopes are built by build_navigation_response and end in "}".
+    """
+    if not version:
+        return response
+    if isinstance(response, bytes):
+        return response + encode_version_frame(version)
+    return f'{response[:-1]}, "version": {json.dumps(version)}}}'
+
+
+def parse_version(value: Optional[Union[str, bytes]]) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value or ""
+
+
+def build_initial_navigation_response(content: str) -> str:
+    """Serialize the initial_navigation reply sent on connect"""
+    return json.dumps({
+        "type": "initial_navigation",
+        "content": content
+    })
+
+
+def build_presence_response(nav_key: str, result) -> str:
+    """Serialize the presence reply from the page presence script result"""
+    return json.dumps(parse_page_presence(nav_key, result))
+
+
+def hash_section(content: str) -> str:
+    """Short content hash identifying a section version to clients"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def build_navigation_delta(nav_key: str,
+                           sections: List[Tuple[str, str, str]],
+                           client_hashes: Dict[str, str],
+                           encoding: str = ENCODING_JSON,
+                           version: str = "") -> Union[str, bytes]:
+    """
+    Serialize a markdown_delta reply carrying only the sections the client lacks.
+
+    sections is the ordered list of (section_id, hash, content) for the document;
+    client_hashes maps the section ids the client holds to their hashes. The client
+    rebuilds the document by joining the sections listed in "order" with blank lines.
+    version names the stored version the sections belong to, when it is known.
+    """
+    added, changed = {}, {}
+    for section_id, section_hash, content in sections:
+        if section_id not in client_hashes:
+            added[section_id] = content
+        elif client_hashes[section_id] != section_hash:
+            changed[section_id] = content
+
+    section_ids = {section_id for section_id, _, _ in sections}
+    removed = [section_id for section_id in client_hashes if section_id not in section_ids]
+
+    if encoding == ENCODING_PROTOBUF:
+        # Every section is listed in order; content is only filled in where the client lacks it
+        return encode_markdown_message(
+            "markdown_delta",
+            filename=nav_key,
+            sections=[
+                (section_id, section_hash, added.get(section_id) or changed.get(section_id, ""))
+                for section_id, section_hash, _ in sections
+            ],
+            removed=removed,
+            version=version,
+        )
+
+    return json.dumps({
+        "type": "markdown_delta",
+        "filename": nav_key,
+        "order": [section_id for section_id, _, _ in sections],
+        "hashes": {section_id: section_hash for section_id, section_hash, _ in sections},
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "version": version,
+    })
+
+
+def build_materialized_payloads(nav_key: str, content: str) -> Dict[str, bytes]:
+    """Encode the response envelopes stored alongside a document's sections"""
+    payloads = {
+        create_payload_key(nav_key, encoding=encoding): encode_payload(build_navigation_response(nav_key, content, encoding))
+        for encoding in (ENCODING_JSON, ENCODING_PROTOBUF)
+    }
+    if nav_key == ROOT_NAV_KEY:
+        payloads[INITIAL_PAYLOAD_KEY] = encode_payload(build_initial_navigation_response(content))
+    return payloads
+
+
+def cache_lookup(cache: Optional[NavigationCache], key: str) -> Tuple[Optional[Any], Optional[int]]:
+    """
+    Cached value of key, and the cache generation to store a fresh load under.
+
+    The generation is read before the load so an invalidation that lands while
+    Redis is being read makes cache_store drop the stale result.
+    """
+    if not cache:
+        return None, None
+    return cache.get(key), cache.generation
+
+
+def cache_store(cache: Optional[NavigationCache],
+                key: str,
+                value: Any,
+                depends_on: List[str],
+                generation: Optional[int]) -> None:
+    if cache:
+        cache.put(key, value, depends_on=depends_on, generation=generation)
+
+
+def parse_section_keys(metadata: Optional[str]) -> List[str]:
+    """Section keys listed in a document's .metadata value, in order"""
+    return json.loads(metadata) if metadata else []
+
+
+def join_sections(section_keys: List[str], contents: List[Optional[str]]) -> Optional[Tuple[List[str], str]]:
+    """(section_keys, document) from an MGET of the sections, or None if none exist"""
+    sections = [content for content in contents if content]
+    if not sections:
+        return None
+    return section_keys, "\n\n".join(sections)
+
+
+def parse_navigation_sections(section_keys: List[str], contents: List[Optional[str]]) -> List[Tuple[str, str, str]]:
+    """
+    Ordered (section_id, hash, content) triples from an MGET of the sections.
+
+    Section keys are content-addressed blobs, so they change with every edit and
+    cannot identify a section to the client. Ids come from create_section_ids
+    instead (heading slug, else position), the same ids version manifests use,
+    and the blob hash goes in the hash column.
+    """
+    present = [(section_key, content) for section_key, content in zip(section_keys, contents) if content]
+    section_ids = create_section_ids([content for _, content in present])
+    return [
+        (section_id,
+         section_key[len(BLOB_PREFIX):] if section_key.startswith(BLOB_PREFIX) else hash_section(content),
+         content)
+        for section_id, (section_key, content) in zip(section_ids, present)
+    ]
+
+
+@dataclass
+class NavigationRequest:
+    """A parsed client message and what the runtime has to do with it"""
+    nav_key: str
+    message_type: str
+    route: str
+    encoding: str = ENCODING_JSON
+    client_hashes: Optional[Dict[str, str]] = None
+    version: Optional[str] = None
+
+    @property
+    def duplicate_key(self) -> Tuple:
+        """What makes two messages the same request; the client's request id is left out"""
+        hashes = tuple(sorted(self.client_hashes.items())) if self.client_hashes is not None else None
+        return (self.message_type, self.nav_key, self.encoding, self.version, hashes)
+
+    @property
+    def flight_key(self) -> Tuple[str, ...]:
+        """Key under which concurrent loads of the same reply are shared"""
+        if self.route == ROUTE_DELTA:
+            return (self.nav_key, "sections")
+        if self.route == ROUTE_SNAPSHOT:
+            return (self.nav_key, self.version, self.encoding)
+        return (self.nav_key, self.encoding)
+
+
+def route_navigation_message(content: str,
+                             sender: Recipient,
+                             duplicates: Optional[DuplicateFilter] = None) -> Optional[NavigationRequest]:
+    """Parse a client message and pick its route, or return None when it is dropped"""
+    message = parse_navigation_message(content)
+    if not message:
+        NAVIGATION_REJECTED.labels('invalid').inc()
+        return None
+
+    message_type = message['type']
+    request = NavigationRequest(nav_key=message['filename'], message_type=message_type, route=ROUTE_CONTENT)
+    if message_type == HEARTBEAT_MESSAGE:
+        request.route = ROUTE_HEARTBEAT
+    elif message_type == PRESENCE_QUERY_MESSAGE:
+        request.route = ROUTE_PRESENCE
+    else:
+        request.encoding = negotiate_encoding(message)
+        client_hashes = message.get('section_hashes')
+        if message.get('version'):
+            # A snapshot of a stored version, as named by an earlier reply
+            request.route = ROUTE_SNAPSHOT
+            request.version = str(message['version'])
+        elif isinstance(client_hashes, dict):
+            # The client already holds some sections; send only what it lacks
+            request.route = ROUTE_DELTA
+            request.client_hashes = client_hashes
+
+    if duplicates and duplicates.is_duplicate(sender.key, request.duplicate_key):
+        logger.info(f"Dropping duplicate request from {sender}")
+        NAVIGATION_REJECTED.labels('duplicate').inc()
+        return None
+    return request
+
+
+def record_navigation_request(request: Optional[NavigationRequest], started: float) -> None:
+    if request is not None:
+        label = message_type_label(request.message_type)
+        NAVIGATION_REQUESTS.labels(label).inc()
+        NAVIGATION_HANDLE_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+
+def load_materialized_payload(payload_key: str,
+                              cache: Optional[NavigationCache] = None,
+                              binary: bool = False,
+                              version_key: Optional[str] = None) -> Steps:
+    """
+    Fetch a stored response envelope: one read, no per-request assembly or serialization.
+
+    With version_key the live version is read in the same MGET and stamped on the reply.
+    """
+    try:
+        cached, generation = cache_lookup(cache, payload_key)
+        if cached is not None:
+            return cached
+
+        # Payloads may be compressed, so they are read as raw bytes regardless of decode_responses
+        keys = [payload_key, version_key] if version_key else [payload_key]
+        blob, *version = yield ("mget_raw", keys)
+        if blob is None:
+            return None
+
+        payload = stamp_version(decode_payload(blob, binary=binary), parse_version(version[0]) if version else None)
+        cache_store(cache, payload_key, payload, keys, generation)
+        return payload
+    except Exception as e:
+        logger.error(f"Failed to get materialized payload {payload_key}: {e}", exc_info=True)
+        return None
+
+
+def load_navigation_content(nav_key: str = ROOT_NAV_KEY, cache: Optional[NavigationCache] = None) -> Steps:
+    """Assembled markdown of a document, serving repeat lookups from the cache"""
+    try:
+        cached, generation = cache_lookup(cache, nav_key)
+        if cached is not None:
+            return cached
+
+        metadata_key = create_metadata_key(nav_key)
+        try:
+            assembled = yield ("assemble_document", metadata_key)
+        except ScriptUnavailable:
+            # Client-side assembly: one GET of the metadata plus one MGET of the sections
+            metadata, = yield ("mget", [metadata_key])
+            section_keys = parse_section_keys(metadata)
+            assembled = join_sections(section_keys, (yield ("mget", section_keys))) if section_keys else None
+
+        if not assembled:
+            return None
+
+        section_keys, document = assembled
+        cache_store(cache, nav_key, document, [metadata_key, *section_keys], generation)
+        return document
+    except Exception as e:
+        logger.error(f"Failed to get navigation content: {e}", exc_info=True)
+        return None
+
+
+def load_navigation_sections(nav_key: str, cache: Optional[NavigationCache] = None) -> Steps:
+    """Live version and ordered (section_id, hash, content) triples of a document, for delta replies"""
+    try:
+        cache_key = create_sections_cache_key(nav_key)
+        cached, generation = cache_lookup(cache, cache_key)
+        if cached is not None:
+            return cached
+
+        metadata_key = create_metadata_key(nav_key)
+        version_key = create_live_version_key(nav_key)
+        metadata, version = yield ("mget", [metadata_key, version_key])
+        section_keys = parse_section_keys(metadata)
+        if not section_keys:
+            return None
+
+        sections = parse_navigation_sections(section_keys, (yield ("mget", section_keys)))
+        if not sections:
+            return None
+
+        result = (parse_version(version), sections)
+        cache_store(cache, cache_key, result, [metadata_key, version_key, *section_keys], generation)
+        return result
+    except Exception as e:
+        logger.error(f"Failed to get navigation sections: {e}", exc_info=True)
+        return None
+
+
+def load_navigation_response(nav_key: str,
+                             cache: Optional[NavigationCache] = None,
+                             encoding: str = ENCODING_JSON) -> Steps:
+    """Serialized markdown_content reply, from the materialized payload when one exists"""
+    response = yield from load_materialized_payload(create_payload_key(nav_key, encoding=encoding), cache,
+                                                    binary=encoding == ENCODING_PROTOBUF,
+                                                    version_key=create_live_version_key(nav_key))
+    if response:
+        return response
+
+    content = yield from load_navigation_content(nav_key, cache)
+    return build_navigation_response(nav_key, content, encoding) if content else None
+
+
+def load_navigation_snapshot(nav_key: str,
+                             version: str,
+                             cache: Optional[NavigationCache] = None,
+                             encoding: str = ENCODING_JSON) -> Steps:
+    """Serialized markdown_content reply for a stored version; versions never change, so they cache well"""
+    cache_key = create_version_key(nav_key, version)
+    content, generation = cache_lookup(cache, cache_key)
+    if content is None:
+        snapshot = yield ("read_version", nav_key, version)
+        if not snapshot:
+            return None
+        content = "\n\n".join(snapshot[1])
+        cache_store(cache, cache_key, content, [cache_key], generation)
+    return build_navigation_response(nav_key, content, encoding, version)
+
+
+def load_prefetch_hints(nav_key: str, limit: int, cache: Optional[NavigationCache] = None) -> Steps:
+    """(nav_key, digest) of the documents a document links to, read from the write-time link index"""
+    try:
+        cache_key = create_links_key(nav_key)
+        cached, generation = cache_lookup(cache, cache_key)
+        if cached is not None:
+            return cached
+
+        links, = yield ("mget", [cache_key])
+        targets = json.loads(links) if links else []
+        digest_keys = [create_digest_key(target) for target in targets]
+        hints = parse_prefetch_hints(targets, (yield ("mget", digest_keys)), limit) if targets else []
+
+        cache_store(cache, cache_key, hints, [cache_key, *digest_keys], generation)
+        return hints
+    except Exception as e:
+        logger.error(f"Failed to get prefetch hints for {nav_key}: {e}", exc_info=True)
+        return []
+
+
+def load_initial_navigation_response(cache: Optional[NavigationCache] = None) -> Steps:
+    """Serialized initial_navigation reply, from the materialized payload when one exists"""
+    response = yield from load_materialized_payload(INITIAL_PAYLOAD_KEY, cache)
+    if response:
+        return response
+
+    content = yield from load_navigation_content(cache=cache)
+    return build_initial_navigation_response(content) if content else None
+
+
+def store_system_events(event_type: str, events: List[Tuple[str, dict]]) -> Steps:
+    """Append system events to the event stream; a failed write never blocks a reply"""
+    try:
+        yield ("record_events", event_type, events)
+    except Exception as e:
+        logger.error(f"Failed to store system events: {e}", exc_info=True)
+
+
+def touch_presence(entries: List[Tuple[str, Optional[str], Optional[str]]]) -> Steps:
+    """Record heartbeats; presence is best effort and never blocks a reply"""
+    try:
+        yield ("touch_presence", entries)
+    except Exception as e:
+        logger.error(f"Failed to update presence: {e}", exc_info=True)
+
+
+def navigation_steps(content: str,
+                     sender: Recipient,
+                     cache: Optional[NavigationCache] = None,
+                     duplicates: Optional[DuplicateFilter] = None,
+                     presence: bool = False,
+                     prefetch_hints: int = 0) -> Steps:
+    """Handle a navigation message; presence says whether the runtime has a presence index"""
+    started = time.perf_counter()
+    request = None
+    viewed_page = None
+    try:
+        request = route_navigation_message(content, sender, duplicates)
+        if not request:
+            return
+
+        nav_key = request.nav_key
+        if request.route == ROUTE_HEARTBEAT:
+            return
+        if request.route == ROUTE_PRESENCE:
+            if presence:
+                response = build_presence_response(nav_key, (yield ("page_presence", nav_key)))
+                yield ("deliver", sender, response, f"presence for {nav_key}")
+            return
+
+        if request.route == ROUTE_DELTA:
+            loaded = yield ("shared", request.flight_key, load_navigation_sections(nav_key, cache))
+            response = build_navigation_delta(nav_key, loaded[1], request.client_hashes, request.encoding,
+                                              loaded[0]) if loaded else None
+        elif request.route == ROUTE_SNAPSHOT:
+            response = yield ("shared", request.flight_key,
+                              load_navigation_snapshot(nav_key, request.version, cache, request.encoding))
+        else:
+            response = yield ("shared", request.flight_key, load_navigation_response(nav_key, cache, request.encoding))
+
+        if not response:
+            logger.warning(f"No content found for {nav_key}")
+            return
+
+        yield ("deliver", sender, response, f"navigation response for {nav_key}")
+        viewed_page = nav_key
+
+        if prefetch_hints > 0:
+            hints = yield from load_prefetch_hints(nav_key, prefetch_hints, cache)
+            if hints:
+                yield ("deliver", sender, build_prefetch_hints_response(nav_key, hints),
+                       f"prefetch hints for {nav_key}")
+
+    except Exception as e:
+        logger.error(f"Error in handle_navigation_event: {e}", exc_info=True)
+    finally:
+        if presence and request:
+            # Heartbeats are recorded once the reply is on its way, never ahead of it. Any message
+            # keeps the sender online, but only a page that was found moves it to that page. A group
+            # sender has no connection id, so its own id stands in for one in the presence index
+            yield from touch_presence([(sender.id, sender.user_id, viewed_page)])
+        record_navigation_request(request, started)
+
+
+def connect_batch_steps(connections: List[Tuple[str, dict]],
+                        cache: Optional[NavigationCache] = None,
+                        presence: bool = False) -> Steps:
+    """Handle a burst of client connections: fetch the root document once and fan it out"""
+    started = time.perf_counter()
+    NAVIGATION_REQUESTS.labels('connect').inc(len(connections))
+    try:
+        yield from store_system_events("connect", connections)
+        response = yield from load_initial_navigation_response(cache)
+
+        if not response:
+            logger.error("Failed to get root navigation content")
+            return
+
+        for connection_id, _ in connections:
+            try:
+                yield ("deliver", to_connection(connection_id), response, "initial navigation")
+            except Exception as e:
+                logger.error(f"Failed to send initial navigation to {connection_id}: {e}", exc_info=True)
+        logger.info(f"Queued initial navigation content for {len(connections)} connection(s)")
+
+    except Exception as e:
+        logger.error(f"Error in handle_connect_batch: {e}", exc_info=True)
+    finally:
+        if presence:
+            yield from touch_presence([(connection_id, user_id_from(data), ROOT_NAV_KEY)
+                                       for connection_id, data in connections])
+        NAVIGATION_HANDLE_SECONDS.labels('connect').observe(time.perf_counter() - started)
+
+
+def disconnect_steps(connection_id: str, presence: bool = False) -> Steps:
+    """Handle client disconnection"""
+    try:
+        yield from store_system_events("disconnect", [(connection_id, {})])
+        if presence:
+            yield ("leave_presence", [connection_id])
+    except Exception as e:
+        logger.error(f"Error in handle_disconnect_event: {e}", exc_info=True)
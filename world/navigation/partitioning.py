@@ -0,0 +1,178 @@
+# partitioning.py
+import os
+import json
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+import time
+from typing import List, Optional
+import redis
+from delivery import Recipient, to_connection, to_user
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MODE_NONE = "none"
+PARTITION_MODE_CLAIM = "claim"
+PARTITION_MODE_HASH = "hash"
+PARTITION_MODES = (PARTITION_MODE_NONE, PARTITION_MODE_CLAIM, PARTITION_MODE_HASH)
+
+REPLICAS_KEY = "woa.navigation.replicas"
+CLAIM_KEY_PREFIX = "woa.navigation.claim"
+CLAIM_TTL = 30
+REPLICA_HEARTBEAT_INTERVAL = 5.0
+REPLICA_TTL = 15.0
+
+
+def get_replica_id() -> str:
+    """Stable for the life of the process; NAVIGATION_REPLICA_ID overrides it"""
+    return os.environ.get('NAVIGATION_REPLICA_ID') or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+
+def message_sender(event) -> Optional[Recipient]:
+    """
+    Who sent an event, the same on every replica, or None if it is anonymous.
+
+    Group messages carry the sender's user id but no connection id, so their
+    replies go to the user. The recipient's key is also the key for per-sender
+    state: rate limit buckets, notices and queues.
+    """
+    connection_id = getattr(event, 'connection_id', None)
+    if connection_id:
+        return to_connection(connection_id)
+    user_id = getattr(event, 'from_user_id', None)
+    return to_user(user_id) if user_id else None
+
+
+def sender_key(event) -> str:
+    # Anonymous messages are rejected at admission, before they reach a partitioner
+    sender = message_sender(event)
+    return sender.key if sender else ""
+
+
+def request_id_from(data) -> Optional[str]:
+    """Client-supplied request id of a message, if any"""
+    if isinstance(data, (str, bytes)):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    request_id = data.get('requestId') or data.get('request_id')
+    return str(request_id) if request_id else None
+
+
+def message_identity(event) -> Optional[str]:
+    """
+    Identify a group message the same way on every replica, or None if it cannot be.
+
+    Only the client's request id qualifies: Web PubSub numbers sequence ids per
+    receiving connection, so replicas see different ones for the same message,
+    and two identical payloads can be two legitimate requests (X -> Y -> X).
+    """
+    request_id = request_id_from(event.data)
+    if not request_id:
+        return None
+    return f"{sender_key(event)}:{request_id}"
+
+
+class RendezvousPartitioner:
+    """
+    Each sender is owned by one live replica, chosen by rendezvous hashing.
+
+    Replicas heartbeat into a sorted set; the live list is refreshed with each
+    heartbeat, so ownership checks need no Redis round trip. When a replica
+    joins or leaves only the senders it wins or loses move.
+    """
+
+    def __init__(self, redis_client: redis.Redis, replica_id: str,
+                 heartbeat_interval: float = REPLICA_HEARTBEAT_INTERVAL,
+                 replica_ttl: float = REPLICA_TTL):
+        self.redis_client = redis_client
+        self.replica_id = replica_id
+        self.heartbeat_interval = heartbeat_interval
+        self.replica_ttl = replica_ttl
+        self._replicas: List[str] = [replica_id]
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name="replica-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat_interval)
+        try:
+            self.redis_client.zrem(REPLICAS_KEY, self.replica_id)
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not deregister replica {self.replica_id}: {e}")
+
+    def heartbeat(self) -> None:
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zadd(REPLICAS_KEY, {self.replica_id: now})
+        pipe.zremrangebyscore(REPLICAS_KEY, "-inf", now - self.replica_ttl)
+        pipe.zrange(REPLICAS_KEY, 0, -1)
+        replicas = pipe.execute()[-1]
+        if replicas != self._replicas:
+            logger.info(f"Navigation replicas: {', '.join(replicas)}")
+        self._replicas = replicas or [self.replica_id]
+
+    def owner(self, key: str) -> str:
+        return max(self._replicas, key=lambda replica: hashlib.sha1(f"{replica}:{key}".encode("utf-8")).digest())
+
+    def should_handle(self, event) -> bool:
+        return self.owner(sender_key(event)) == self.replica_id
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(timeout=self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Replica heartbeat failed: {e}", exc_info=True)
+
+
+class ClaimPartitioner(RendezvousPartitioner):
+    """
+    First replica to claim a message handles it.
+
+    Every replica still receives every group message, but only the one whose
+    SET NX on the message's request id wins does the Redis reads and sends the
+    reply. Messages without a request id cannot be claimed consistently, so
+    they fall back to rendezvous ownership of their sender.
+    """
+
+    def __init__(self, redis_client: redis.Redis, replica_id: str, claim_ttl: int = CLAIM_TTL, **kwargs):
+        super().__init__(redis_client, replica_id, **kwargs)
+        self.claim_ttl = claim_ttl
+
+    def should_handle(self, event) -> bool:
+        identity = message_identity(event)
+        if identity is None:
+            return super().should_handle(event)
+        claim_key = f"{CLAIM_KEY_PREFIX}.{identity}"
+        try:
+            return bool(self.redis_client.set(claim_key, self.replica_id, nx=True, ex=self.claim_ttl))
+        except redis.RedisError as e:
+            # Duplicate replies are better than none
+            logger.warning(f"⚠️ Could not claim message, handling it locally: {e}")
+            return True
+
+
+def create_partitioner(redis_client: redis.Redis, mode: str):
+    """Partitioner for the configured mode, or None when every replica handles every message"""
+    mode = (mode or PARTITION_MODE_NONE).lower()
+    if mode not in PARTITION_MODES:
+        raise ValueError(f"Unknown partition mode {mode!r}, expected one of {', '.join(PARTITION_MODES)}")
+    if mode == PARTITION_MODE_NONE:
+        return None
+    replica_id = get_replica_id()
+    logger.info(f"✅ Partitioning navigation requests by {mode} as replica {replica_id}")
+    if mode == PARTITION_MODE_CLAIM:
+        return ClaimPartitioner(redis_client, replica_id)
+    return RendezvousPartitioner(redis_client, replica_id)
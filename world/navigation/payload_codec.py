@@ -0,0 +1,47 @@
+# payload_codec.py
+import os
+import gzip
+import logging
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip from the stdlib is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DEFAULT_COMPRESSION = "none"
+
+
+def get_payload_compression() -> str:
+    """Compression used for materialized payloads: none, gzip or zstd"""
+    compression = os.environ.get('NAVIGATION_PAYLOAD_COMPRESSION', DEFAULT_COMPRESSION).lower()
+    if compression == "zstd" and zstandard is None:
+        logger.warning("⚠️ zstandard is not installed, storing payloads with gzip instead")
+        return "gzip"
+    return compression
+
+
+def encode_payload(payload: Union[str, bytes], compression: Optional[str] = None) -> bytes:
+    """Encode a serialized response envelope (JSON text or protobuf bytes) for storage in Redis"""
+    compression = compression or get_payload_compression()
+    data = payload.encode("utf-8") if isinstance(payload, str) else payload
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def decode_payload(blob: bytes, binary: bool = False) -> Union[str, bytes]:
+    """Decode a stored payload, detecting the compression from its magic bytes"""
+    if blob.startswith(GZIP_MAGIC):
+        blob = gzip.decompress(blob)
+    elif blob.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed payload found but zstandard is not installed")
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    return blob if binary else blob.decode("utf-8")
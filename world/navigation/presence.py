@@ -0,0 +1,188 @@
+# presence.py
+import logging
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Key layout (kept outside woa.world.* so presence writes never invalidate cached documents):
+#   woa.presence.connections          zset  connection_id -> last heartbeat
+#   woa.presence.connection.{id}      hash  user, page, seen
+#   woa.presence.page.{nav_key}       zset  connection_id -> last heartbeat
+#   woa.presence.user.{user_id}       zset  connection_id -> last heartbeat
+# The scripts below spell out the same prefixes; like redis_scripts.py they assume a
+# non-clustered cache because they touch keys that are not passed in KEYS.
+PRESENCE_CONNECTIONS_KEY = "woa.presence.connections"
+DEFAULT_PRESENCE_TTL = 90.0
+PRESENCE_REAP_INTERVAL = 30.0
+PRESENCE_REAP_BATCH = 500
+HEARTBEAT_MESSAGE = "heartbeat"
+PRESENCE_QUERY_MESSAGE = "presence_query"
+
+_LEAVE_FUNCTION = """
+local function leave(connection_id)
+    local connection_key = 'woa.presence.connection.' .. connection_id
+    local current = redis.call('HMGET', connection_key, 'user', 'page')
+    if current[1] and current[1] ~= '' then
+        redis.call('ZREM', 'woa.presence.user.' .. current[1], connection_id)
+    end
+    if current[2] and current[2] ~= '' then
+        redis.call('ZREM', 'woa.presence.page.' .. current[2], connection_id)
+    end
+    redis.call('DEL', connection_key)
+    redis.call('ZREM', 'woa.presence.connections', connection_id)
+end
+"""
+
+# ARGV[1] = now, then (connection_id, user_id, nav_key) triples; '' keeps the current value
+TOUCH_SCRIPT = """
+local now = ARGV[1]
+for i = 2, #ARGV, 3 do
+    local connection_id, user, page = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    local connection_key = 'woa.presence.connection.' .. connection_id
+    local current = redis.call('HMGET', connection_key, 'user', 'page')
+
+    if user ~= '' and current[1] and current[1] ~= '' and current[1] ~= user then
+        redis.call('ZREM', 'woa.presence.user.' .. current[1], connection_id)
+    end
+    if page ~= '' and current[2] and current[2] ~= '' and current[2] ~= page then
+        redis.call('ZREM', 'woa.presence.page.' .. current[2], connection_id)
+    end
+    if user == '' then user = current[1] or '' end
+    if page == '' then page = current[2] or '' end
+
+    redis.call('HSET', connection_key, 'user', user, 'page', page, 'seen', now)
+    redis.call('ZADD', 'woa.presence.connections', now, connection_id)
+    if user ~= '' then
+        redis.call('ZADD', 'woa.presence.user.' .. user, now, connection_id)
+    end
+    if page ~= '' then
+        redis.call('ZADD', 'woa.presence.page.' .. page, now, connection_id)
+    end
+end
+return (#ARGV - 1) / 3
+"""
+
+# ARGV = connection ids
+LEAVE_SCRIPT = _LEAVE_FUNCTION + """
+for i = 1, #ARGV do
+    leave(ARGV[i])
+end
+return #ARGV
+"""
+
+# ARGV[1] = cutoff, ARGV[2] = max connections to expire in one call
+REAP_SCRIPT = _LEAVE_FUNCTION + """
+local stale = redis.call('ZRANGEBYSCORE', 'woa.presence.connections', '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for i = 1, #stale do
+    leave(stale[i])
+end
+return #stale
+"""
+
+# ARGV[1] = nav_key, ARGV[2] = cutoff; returns {connection_count, user_id...}
+PAGE_PRESENCE_SCRIPT = """
+local connections = redis.call('ZRANGEBYSCORE', 'woa.presence.page.' .. ARGV[1], ARGV[2], '+inf')
+local seen = {}
+local result = {#connections}
+for i = 1, #connections do
+    local user = redis.call('HGET', 'woa.presence.connection.' .. connections[i], 'user')
+    if user and user ~= '' and not seen[user] then
+        seen[user] = true
+        result[#result + 1] = user
+    end
+end
+return result
+"""
+
+
+def parse_page_presence(nav_key: str, result) -> dict:
+    """Shape the page presence script result into the presence reply body"""
+    result = result or [0]
+    return {
+        "type": "presence",
+        "filename": nav_key,
+        "connections": int(result[0]),
+        "users": sorted(result[1:]),
+    }
+
+
+class PresenceIndex:
+    """
+    Who is online, and on which page, kept in sorted sets scored by last heartbeat.
+
+    Works with both the sync and the asyncio Redis client: with an asyncio
+    client every method returns an awaitable. Queries only count entries seen
+    within `ttl` seconds, so they stay correct between reaper runs.
+    """
+
+    def __init__(self, redis_client, ttl: float = DEFAULT_PRESENCE_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._touch = redis_client.register_script(TOUCH_SCRIPT)
+        self._leave = redis_client.register_script(LEAVE_SCRIPT)
+        self._reap = redis_client.register_script(REAP_SCRIPT)
+        self._page_presence = redis_client.register_script(PAGE_PRESENCE_SCRIPT)
+
+    def touch(self, entries: Iterable[Tuple[str, Optional[str], Optional[str]]], now: Optional[float] = None):
+        """Record a heartbeat for (connection_id, user_id, nav_key) entries in one round trip"""
+        args: List[str] = [str(now or time.time())]
+        for connection_id, user_id, nav_key in entries:
+            args += [connection_id, user_id or "", nav_key or ""]
+        return self._touch(args=args)
+
+    def leave(self, connection_ids: Iterable[str]):
+        return self._leave(args=list(connection_ids))
+
+    def reap(self, now: Optional[float] = None, limit: int = PRESENCE_REAP_BATCH):
+        """Drop connections whose last heartbeat is older than the TTL"""
+        return self._reap(args=[(now or time.time()) - self.ttl, limit])
+
+    def page_presence(self, nav_key: str, now: Optional[float] = None):
+        return self._page_presence(args=[nav_key, (now or time.time()) - self.ttl])
+
+    def online_count(self, now: Optional[float] = None):
+        return self.redis_client.zcount(PRESENCE_CONNECTIONS_KEY, (now or time.time()) - self.ttl, "+inf")
+
+    def user_connections(self, user_id: str, now: Optional[float] = None):
+        return self.redis_client.zrangebyscore(f"woa.presence.user.{user_id}", (now or time.time()) - self.ttl, "+inf")
+
+
+def user_id_from(data: Optional[dict]) -> Optional[str]:
+    """User id carried in connect user_data, if any; message senders come from the event instead"""
+    if not isinstance(data, dict):
+        return None
+    user_id = data.get('user_id') or data.get('userId')
+    return str(user_id) if user_id else None
+
+
+class PresenceReaper:
+    """Background thread that removes connections that stopped sending heartbeats"""
+
+    def __init__(self, presence: PresenceIndex, interval: float = PRESENCE_REAP_INTERVAL):
+        self.presence = presence
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="presence-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(timeout=self.interval):
+            try:
+                total = expired = self.presence.reap()
+                while expired == PRESENCE_REAP_BATCH and not self._stop_event.is_set():
+                    expired = self.presence.reap()
+                    total += expired
+                if total:
+                    logger.info(f"Expired {total} stale presence entries")
+            except Exception as e:
+                logger.error(f"Error expiring presence entries: {e}", exc_info=True)
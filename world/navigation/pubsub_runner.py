@@ -0,0 +1,132 @@
+# pubsub_runner.py
+import time
+import signal
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable
+from azure.messaging.webpubsubclient import WebPubSubClient
+from azure.messaging.webpubsubclient.models import CallbackType, SendMessageError
+from connection_manager import create_pubsub_client
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_CHECK_INTERVAL = 1.0
+RECONNECT_GRACE_PERIOD = 30.0
+RECONNECT_BASE_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+
+def install_shutdown_handlers(shutdown_event: threading.Event) -> None:
+    """Turn SIGTERM/SIGINT into a shutdown event so the runner can exit cleanly"""
+    def handle_signal(signum, frame):
+        logger.info(f"🛑 Received {signal.Signals(signum).name}, shutting down...")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+
+def join_navigation_group(pubsub_client: WebPubSubClient, navigation_group: str) -> None:
+    """Join the navigation group, retrying once with the original ack id"""
+    try:
+        pubsub_client.join_group(navigation_group)
+        logger.info(f"✅ Successfully joined group: {navigation_group}")
+    except SendMessageError as e:
+        logger.warning(f"⚠️ Initial join attempt failed, retrying...")
+        try:
+            pubsub_client.join_group(navigation_group, ack_id=e.ack_id)
+            logger.info(f"✅ Joined group after retry: {navigation_group}")
+        except Exception as retry_error:
+            logger.error(f"❌ Failed to join group after retry: {retry_error}")
+            raise
+    except Exception as e:
+        logger.error(f"❌ Failed to join group: {e}")
+        raise
+
+
+@contextmanager
+def run_pubsub_session(config: dict, callbacks_factory: Callable, stopped_event: threading.Event = None):
+    """Open one WebPubSub connection, join the navigation group and yield the client.
+
+    stopped_event is set when the client gives up on its own reconnect attempts,
+    which tells the runner to build a fresh connection.
+    """
+    pubsub_client = None
+    navigation_group = "navigation-events"
+
+    try:
+        service_client, pubsub_client = create_pubsub_client(config)
+
+        def on_stopped(event):
+            """The client has exhausted its own reconnect attempts"""
+            logger.warning("⚠️ WebPubSub client stopped")
+            if stopped_event:
+                stopped_event.set()
+
+        # Set up event handlers
+        for callback_type, callback in callbacks_factory(service_client).items():
+            pubsub_client.subscribe(callback_type, callback)
+        pubsub_client.subscribe(CallbackType.STOPPED, on_stopped)
+
+        with pubsub_client:  # Keeps the connection open
+            logger.info("🔗 WebPubSub client connection established")
+            join_navigation_group(pubsub_client, navigation_group)
+            yield pubsub_client
+
+    finally:
+        if pubsub_client:
+            pubsub_client.close()
+            logger.info("🔌 WebPubSub client closed")
+
+
+def wait_for_reconnect(pubsub_client: WebPubSubClient,
+                       stopped_event: threading.Event,
+                       shutdown_event: threading.Event) -> bool:
+    """Give the client's built-in auto-reconnect a chance before rebuilding the session"""
+    deadline = time.monotonic() + RECONNECT_GRACE_PERIOD
+    while time.monotonic() < deadline and not shutdown_event.is_set():
+        if stopped_event.wait(timeout=SHUTDOWN_CHECK_INTERVAL):
+            return False
+        if pubsub_client.is_connected():
+            return True
+    return pubsub_client.is_connected()
+
+
+def run_pubsub_service(config: dict, callbacks_factory: Callable, shutdown_event: threading.Event = None) -> None:
+    """
+    Keep the WebPubSub connection alive until shutdown.
+
+    The main thread sleeps on events instead of polling: it wakes when the client
+    stops or a shutdown signal arrives, and reconnects with exponential backoff.
+    """
+    shutdown_event = shutdown_event or threading.Event()
+    attempt = 0
+
+    while not shutdown_event.is_set():
+        stopped_event = threading.Event()
+        try:
+            with run_pubsub_session(config, callbacks_factory, stopped_event) as pubsub_client:
+                attempt = 0
+                logger.info("🟢 WebPubSub event loop is running...")
+
+                while not shutdown_event.is_set():
+                    # Blocks without burning CPU; the timeout only bounds shutdown latency
+                    if stopped_event.wait(timeout=SHUTDOWN_CHECK_INTERVAL):
+                        break
+                    if not pubsub_client.is_connected() and not wait_for_reconnect(
+                            pubsub_client, stopped_event, shutdown_event):
+                        break
+
+        except Exception as e:
+            logger.error(f"❌ WebPubSub session failed: {e}", exc_info=True)
+
+        if shutdown_event.is_set():
+            break
+
+        delay = min(RECONNECT_BASE_DELAY * (2 ** attempt), RECONNECT_MAX_DELAY)
+        attempt += 1
+        logger.warning(f"🔄 WebPubSub connection lost, reconnecting in {delay}s (attempt {attempt})")
+        shutdown_event.wait(timeout=delay)
+
+    logger.info("👋 WebPubSub service stopped")
@@ -0,0 +1,180 @@
+# rate_limit.py
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECTION_RATE = 10.0
+DEFAULT_CONNECTION_BURST = 20
+DEFAULT_GLOBAL_RATE = 500.0
+DEFAULT_GLOBAL_BURST = 1000
+MAX_TRACKED_CONNECTIONS = 10000
+REJECTION_NOTICE_INTERVAL = 1.0
+RATE_LIMIT_KEY_PREFIX = "woa.navigation.ratelimit"
+
+# KEYS[1] = connection bucket, KEYS[2] = global bucket
+# ARGV = connection rate, connection burst, global rate, global burst (rate <= 0 disables a bucket)
+# Takes one token from both buckets or from neither; returns nil when admitted,
+# otherwise the seconds until a token is available, as a string.
+TAKE_TOKEN_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local function available(key, rate, burst)
+    if rate <= 0 then
+        return nil
+    end
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - ts) * rate)
+end
+
+local rates = {tonumber(ARGV[1]), tonumber(ARGV[3])}
+local bursts = {tonumber(ARGV[2]), tonumber(ARGV[4])}
+local tokens = {}
+local wait = 0
+for i = 1, 2 do
+    tokens[i] = available(KEYS[i], rates[i], bursts[i])
+    if tokens[i] and tokens[i] < 1 then
+        wait = math.max(wait, (1 - tokens[i]) / rates[i])
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i = 1, 2 do
+    if tokens[i] then
+        redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+        redis.call('PEXPIRE', KEYS[i], math.ceil(bursts[i] / rates[i] * 1000) + 1000)
+    end
+end
+return nil
+"""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        # A bucket created after `now` was read must not refill backwards
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+    def wait_time(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+def build_rate_limited_response(retry_after: float) -> str:
+    """Fast rejection sent instead of a navigation reply"""
+    return json.dumps({
+        "type": "rate_limited",
+        "retry_after": round(retry_after, 3),
+    })
+
+
+class RateLimiter:
+    """
+    Admission control for incoming navigation messages.
+
+    Each connection gets its own token bucket and all connections share a
+    global one; a message is admitted only if both have a token. With a
+    redis_client the buckets live in Redis and are shared by every replica,
+    otherwise they are kept in process. A rate of 0 disables that bucket.
+    """
+
+    def __init__(self,
+                 connection_rate: float = DEFAULT_CONNECTION_RATE,
+                 connection_burst: int = DEFAULT_CONNECTION_BURST,
+                 global_rate: float = DEFAULT_GLOBAL_RATE,
+                 global_burst: int = DEFAULT_GLOBAL_BURST,
+                 redis_client: Optional[redis.Redis] = None):
+        self.connection_rate = connection_rate
+        self.connection_burst = connection_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.redis_client = redis_client
+        self._take_token = redis_client.register_script(TAKE_TOKEN_SCRIPT) if redis_client else None
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._notified: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, connection_id: str) -> Optional[float]:
+        """None if the message is admitted, otherwise seconds until the client may retry"""
+        if self._take_token:
+            try:
+                wait = self._take_token(
+                    keys=[f"{RATE_LIMIT_KEY_PREFIX}.connection.{connection_id}", f"{RATE_LIMIT_KEY_PREFIX}.global"],
+                    args=[self.connection_rate, self.connection_burst, self.global_rate, self.global_burst]
+                )
+                return float(wait) if wait is not None else None
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Shared rate limit unavailable, using local buckets: {e}")
+        return self._check_local(connection_id)
+
+    def _check_local(self, connection_id: str) -> Optional[float]:
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._connection_bucket(connection_id)] if self.connection_rate > 0 else []
+            if self._global:
+                buckets.append(self._global)
+            for bucket in buckets:
+                bucket.refill(now)
+            wait = max((bucket.wait_time() for bucket in buckets), default=0.0)
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return None
+
+    def _connection_bucket(self, connection_id: str) -> TokenBucket:
+        bucket = self._buckets.get(connection_id)
+        if bucket is None:
+            bucket = self._buckets[connection_id] = TokenBucket(self.connection_rate, self.connection_burst)
+            if len(self._buckets) > MAX_TRACKED_CONNECTIONS:
+                # Least recently active connection; a fresh bucket for it is full anyway
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(connection_id)
+        return bucket
+
+    def should_notify(self, connection_id: str) -> bool:
+        """Rejection notices are themselves limited so a flood is not answered message for message"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._notified.get(connection_id)
+            if last is not None and now - last < REJECTION_NOTICE_INTERVAL:
+                return False
+            self._notified[connection_id] = now
+            self._notified.move_to_end(connection_id)
+            if len(self._notified) > MAX_TRACKED_CONNECTIONS:
+                self._notified.popitem(last=False)
+            return True
+
+
+def create_rate_limiter(config: dict, redis_client=None) -> Optional[RateLimiter]:
+    """Token buckets for incoming messages; Redis-backed when shared across replicas"""
+    if config['rate_limit'] <= 0 and config['global_rate_limit'] <= 0:
+        return None
+    return RateLimiter(
+        connection_rate=config['rate_limit'],
+        connection_burst=config['rate_burst'],
+        global_rate=config['global_rate_limit'],
+        global_burst=config['global_rate_burst'],
+        redis_client=redis_client if config['rate_limit_shared'] else None
+    )
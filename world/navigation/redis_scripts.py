@@ -0,0 +1,97 @@
+# redis_scripts.py
+import json
+import logging
+from typing import List, Optional, Tuple
+import redis
+import redis.asyncio as redis_asyncio
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = "{nav_key}.metadata"
+# Returns {section_keys_json, joined_markdown} or nil. Running server-side gives
+# one round trip per page view and a consistent snapshot while content is rewritten.
+# Section keys are read from metadata rather than passed as KEYS, so this relies on
+# a non-clustered cache (all keys on one shard), which is what we run on Azure.
+ASSEMBLE_DOCUMENT_SCRIPT = """
+local metadata = redis.call('GET', KEYS[1])
+if not metadata then
+    return nil
+end
+
+local section_keys = cjson.decode(metadata)
+if #section_keys == 0 then
+    return nil
+end
+
+local values = redis.call('MGET', unpack(section_keys))
+local sections = {}
+for i = 1, #section_keys do
+    if values[i] then
+        sections[#sections + 1] = values[i]
+    end
+end
+
+if #sections == 0 then
+    return nil
+end
+return {metadata, table.concat(sections, '\\n\\n')}
+"""
+
+_assemble_document_sha: Optional[str] = None
+
+
+class ScriptUnavailable(Exception):
+    """The server-side script is not registered; callers should use the client-side path"""
+
+
+def register_scripts(redis_client: redis.Redis) -> bool:
+    """Load the navigation scripts on boot; returns False if scripting is unavailable"""
+    global _assemble_document_sha
+    try:
+        _assemble_document_sha = redis_client.script_load(ASSEMBLE_DOCUMENT_SCRIPT)
+        logger.info(f"✅ Registered assemble-document script {_assemble_document_sha}")
+        return True
+    except redis.RedisError as e:
+        _assemble_document_sha = None
+        logger.warning(f"⚠️ Could not register Lua scripts, using client-side assembly: {e}")
+        return False
+
+
+def _parse_assembled(result) -> Optional[Tuple[List[str], str]]:
+    if not result:
+        return None
+    metadata, document = result
+    return json.loads(metadata), document
+
+
+def assemble_document(redis_client: redis.Redis, metadata_key: str) -> Optional[Tuple[List[str], str]]:
+    """Return (section_keys, document) in one EVALSHA, or raise ScriptUnavailable"""
+    if not _assemble_document_sha:
+        raise ScriptUnavailable()
+    try:
+        return _parse_assembled(redis_client.evalsha(_assemble_document_sha, 1, metadata_key))
+    except redis.exceptions.NoScriptError:
+        # Script cache was flushed (restart/failover); reload once before giving up
+        logger.warning("⚠️ Assemble-document script missing on server, reloading")
+        if not register_scripts(redis_client):
+            raise ScriptUnavailable()
+        return _parse_assembled(redis_client.evalsha(_assemble_document_sha, 1, metadata_key))
+
+
+async def assemble_document_async(redis_client: redis_asyncio.Redis,
+                                  metadata_key: str) -> Optional[Tuple[List[str], str]]:
+    """asyncio variant of assemble_document"""
+    global _assemble_document_sha
+    if not _assemble_document_sha:
+        raise ScriptUnavailable()
+    try:
+        return _parse_assembled(await redis_client.evalsha(_assemble_document_sha, 1, metadata_key))
+    except redis.exceptions.NoScriptError:
+        logger.warning("⚠️ Assemble-document script missing on server, reloading")
+        try:
+            _assemble_document_sha = await redis_client.script_load(ASSEMBLE_DOCUMENT_SCRIPT)
+        except redis.RedisError as e:
+            _assemble_document_sha = None
+            logger.warning(f"⚠️ Could not reload Lua scripts, using client-side assembly: {e}")
+            raise ScriptUnavailable()
+        return _parse_assembled(await redis_client.evalsha(_assemble_document_sha, 1, metadata_key))
@@ -0,0 +1,228 @@
+# reference_index.py
+import re
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import redis
+from link_graph import LINK_PATTERN
+from version_store import slugify
+
+logger = logging.getLogger(__name__)
+
+# Forward and reverse sets from mardown-data-format.md section 4.1. The spec's
+# {doc}:{version}:section:{id} is a section key here, e.g.
+# refs:woa.world.navigation.city.markdown.index.section.1
+FORWARD_REFS_PREFIX = "refs:"
+REVERSE_REFS_PREFIX = "backrefs:"
+# Every target with at least one referrer; the broken-link report starts here
+REFERENCE_TARGETS_KEY = "refs:targets"
+REPORT_BATCH_SIZE = 1000
+
+# [[doc:name:version:section:title]] or [[doc:name:version:full]]; titles may contain spaces
+DOC_REFERENCE_PATTERN = re.compile(r"\[\[(doc:[^\[\]\n]+?)\]\]")
+
+# KEYS[1] = forward set of the section, KEYS[2] = REFERENCE_TARGETS_KEY
+# ARGV[1] = reverse set prefix, ARGV[2] = section key, ARGV[3..] = current targets
+# Diffs the section's new targets against its stored forward set and updates only
+# the reverse sets that changed. Reverse keys are built from ARGV, so like the other
+# scripts this relies on a non-clustered cache.
+UPDATE_REFERENCES_SCRIPT = """
+local current = {}
+for i = 3, #ARGV do
+    current[ARGV[i]] = true
+end
+
+for _, target in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if current[target] then
+        current[target] = nil
+    else
+        local reverse_key = ARGV[1] .. target
+        redis.call('SREM', reverse_key, ARGV[2])
+        redis.call('SREM', KEYS[1], target)
+        if redis.call('SCARD', reverse_key) == 0 then
+            redis.call('SREM', KEYS[2], target)
+        end
+    end
+end
+
+local added = 0
+for target in pairs(current) do
+    redis.call('SADD', KEYS[1], target)
+    redis.call('SADD', ARGV[1] .. target, ARGV[2])
+    redis.call('SADD', KEYS[2], target)
+    added = added + 1
+end
+return added
+"""
+
+# KEYS[1] = document metadata, KEYS[2] = REFERENCE_TARGETS_KEY
+# ARGV[1] = forward set prefix, ARGV[2] = reverse set prefix, ARGV[3] = name of a
+# single-section document, ARGV[4] = section name prefix, ARGV[5] = new section count
+# Queued ahead of the metadata rewrite, so the old section count is read from the
+# metadata still in place. Section names follow sample_content.create_section_keys;
+# names the document no longer has leave every reverse set they were in.
+DROP_STALE_SECTIONS_SCRIPT = """
+local function section_names(count)
+    if count == 1 then
+        return {ARGV[3]}
+    end
+    local names = {}
+    for i = 0, count - 1 do
+        names[#names + 1] = ARGV[4] .. i
+    end
+    return names
+end
+
+local metadata = redis.call('GET', KEYS[1])
+local old_count = metadata and #cjson.decode(metadata) or 0
+local kept = {}
+for _, name in ipairs(section_names(tonumber(ARGV[5]))) do
+    kept[name] = true
+end
+
+local dropped = 0
+for _, name in ipairs(section_names(old_count)) do
+    if not kept[name] then
+        local forward_key = ARGV[1] .. name
+        for _, target in ipairs(redis.call('SMEMBERS', forward_key)) do
+            local reverse_key = ARGV[2] .. target
+            redis.call('SREM', reverse_key, name)
+            if redis.call('SCARD', reverse_key) == 0 then
+                redis.call('SREM', KEYS[2], target)
+            end
+        end
+        redis.call('DEL', forward_key)
+        dropped = dropped + 1
+    end
+end
+return dropped
+"""
+
+
+def create_forward_refs_key(section_key: str) -> str:
+    return f"{FORWARD_REFS_PREFIX}{section_key}"
+
+
+def create_reverse_refs_key(target: str) -> str:
+    return f"{REVERSE_REFS_PREFIX}{target}"
+
+
+def normalize_reference(reference: str) -> str:
+    """
+    Canonical target of a [[doc:...]] reference.
+
+    [[doc:name:version:full]] points at the whole document version. Section
+    titles are slugified the way version_store.create_section_ids names
+    sections, so [[doc:name:v1:section:Main Routes]] targets section main-routes.
+    """
+    parts = [part.strip() for part in reference.split(":")]
+    if parts[-1] == "full":
+        return ":".join(parts[:3])
+    if len(parts) >= 5 and parts[3] == "section":
+        return ":".join([*parts[:4], slugify(":".join(parts[4:]))])
+    return ":".join(parts)
+
+
+def extract_references(content: str) -> Set[str]:
+    """Targets a section refers to: linked nav_keys and [[doc:...]] references"""
+    targets = set(LINK_PATTERN.findall(content))
+    targets.update(normalize_reference(reference) for reference in DOC_REFERENCE_PATTERN.findall(content))
+    return targets
+
+
+def resolve_reference(target: str) -> Tuple[str, Optional[str]]:
+    """
+    Key, and hash field when there is one, whose existence makes a reference valid.
+
+    Navigation links resolve to the document's metadata. [[doc:...]] references
+    resolve to a version manifest doc:{name}:{version} written by version_store,
+    and section references to its section:{id} field, with the title slugified.
+    """
+    if target.startswith("woa."):
+        return f"{target}.metadata", None
+    parts = target.split(":")
+    if len(parts) >= 5 and parts[3] == "section":
+        return ":".join(parts[:3]), f"section:{slugify(':'.join(parts[4:]))}"
+    return target, None
+
+
+def queue_reference_updates(pipe, sections: Dict[str, str]) -> None:
+    """
+    Queue forward/reverse set updates for rewritten sections, in the same pipeline as the write.
+
+    Pass an empty string for a section that was deleted to drop its references.
+    """
+    if not sections:
+        return
+    update_references = pipe.register_script(UPDATE_REFERENCES_SCRIPT)
+    for section_key, content in sections.items():
+        update_references(
+            keys=[create_forward_refs_key(section_key), REFERENCE_TARGETS_KEY],
+            args=[REVERSE_REFS_PREFIX, section_key, *sorted(extract_references(content))],
+            client=pipe
+        )
+
+
+def queue_stale_section_removal(pipe,
+                                metadata_key: str,
+                                document_name: str,
+                                section_prefix: str,
+                                section_count: int) -> None:
+    """
+    Queue dropping the references of sections a document is about to lose.
+
+    Must be queued before the metadata rewrite in the same pipeline; pass
+    section_count=0 when the document is deleted.
+    """
+    drop_stale_sections = pipe.register_script(DROP_STALE_SECTIONS_SCRIPT)
+    drop_stale_sections(
+        keys=[metadata_key, REFERENCE_TARGETS_KEY],
+        args=[FORWARD_REFS_PREFIX, REVERSE_REFS_PREFIX, document_name, section_prefix, section_count],
+        client=pipe
+    )
+
+
+def get_references(redis_client: redis.Redis, section_key: str) -> Set[str]:
+    """Targets a section refers to"""
+    return redis_client.smembers(create_forward_refs_key(section_key))
+
+
+def get_backlinks(redis_client: redis.Redis, target: str) -> Set[str]:
+    """Section keys that refer to a nav_key or [[doc:...]] target"""
+    return redis_client.smembers(create_reverse_refs_key(target))
+
+
+def _batched(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_broken_references(redis_client: redis.Redis) -> Dict[str, List[str]]:
+    """
+    Every referenced target that does not exist, with the sections that refer to it.
+
+    Reads the target registry, checks existence of all targets in one pipeline
+    per batch and fetches referrers only for the missing ones, so the cost is a
+    few round trips per REPORT_BATCH_SIZE targets instead of lookups per document.
+    """
+    targets = sorted(redis_client.smembers(REFERENCE_TARGETS_KEY))
+    broken: Dict[str, List[str]] = {}
+    for batch in _batched(targets, REPORT_BATCH_SIZE):
+        pipe = redis_client.pipeline(transaction=False)
+        for target in batch:
+            key, field = resolve_reference(target)
+            if field:
+                pipe.hexists(key, field)
+            else:
+                pipe.exists(key)
+        missing = [target for target, exists in zip(batch, pipe.execute()) if not exists]
+        if not missing:
+            continue
+
+        pipe = redis_client.pipeline(transaction=False)
+        for target in missing:
+            pipe.smembers(create_reverse_refs_key(target))
+        for target, referrers in zip(missing, pipe.execute()):
+            broken[target] = sorted(referrers)
+
+    logger.info(f"Checked {len(targets)} reference targets, {len(broken)} broken")
+    return broken
@@ -1,11 +1,21 @@
 # sample_content.py
-import json
+import hashlib
 import redis
 import logging
-from typing import Dict
+from typing import Dict, List
+from cache_invalidation import publish_invalidation
+from navigation_core import build_materialized_payloads, create_live_version_key
+from link_graph import build_link_index
+from reference_index import queue_reference_updates, queue_stale_section_removal
+from version_store import queue_version_commit
+from section_store import queue_document_sections
 
 logger = logging.getLogger(__name__)
 
+CONTENT_VERSION_KEY = "woa.world.seed.content_version"
+# Bump when the stored layout (sections, metadata, payloads) changes so replicas re-seed
+SEED_FORMAT_VERSION = 6
+
 def create_navigation_key(path: str) -> str:
     """Create consistent navigation keys"""
     return f"woa.world.navigation.{path}"
@@ -14,19 +24,94 @@ def create_metadata_key(nav_key: str) -> str:
     """Create metadata key from navigation key"""
     return f"{nav_key}.metadata"
 
+def create_section_prefix(nav_key: str) -> str:
+    return f"{nav_key}.section."
+
+def create_section_key(nav_key: str, index: int) -> str:
+    """Name of one section of a multi-section document, used by the reference index"""
+    return f"{create_section_prefix(nav_key)}{index}"
+
+def create_section_keys(nav_key: str, section_count: int) -> List[str]:
+    """Single-section documents are named by the nav_key itself"""
+    if section_count == 1:
+        return [nav_key]
+    return [create_section_key(nav_key, index) for index in range(section_count)]
+
+def queue_navigation_sections(pipe, nav_key: str, sections: List[str]) -> List[str]:
+    """
+    Queue the section, metadata, payload and link/reference index writes for one document.
+
+    Section content goes to shared content-addressed blobs and the metadata lists
+    their keys. The version commit also points {nav_key}.version at the version
+    the live document now is. Returns the document keys written, for cache invalidation.
+    """
+    metadata_key = create_metadata_key(nav_key)
+    content = "\n\n".join(sections)
+    payloads = build_materialized_payloads(nav_key, content)
+    link_index = build_link_index(nav_key, content)
+    # Reads the old section count from the metadata, so it goes ahead of the rewrite
+    queue_stale_section_removal(pipe, metadata_key, nav_key, create_section_prefix(nav_key), len(sections))
+    queue_document_sections(pipe, metadata_key, sections)
+    pipe.mset(payloads)
+    pipe.mset(link_index)
+    queue_reference_updates(pipe, dict(zip(create_section_keys(nav_key, len(sections)), sections)))
+    # History: unchanged content adds no version and existing section blobs are not rewritten
+    live_version_key = create_live_version_key(nav_key)
+    queue_version_commit(pipe, nav_key, sections, live_version_key=live_version_key)
+    return [metadata_key, live_version_key, *payloads, *link_index]
+
+def queue_navigation_content(pipe, nav_key: str, content: str) -> List[str]:
+    """Queue the writes for a single-section document"""
+    return queue_navigation_sections(pipe, nav_key, [content])
+
 def store_navigation_content(redis_client: redis.Redis,
                            nav_key: str,
                            content: str) -> None:
     """Store navigation content with metadata"""
     try:
-        redis_client.set(nav_key, content)
-        metadata_key = create_metadata_key(nav_key)
-        redis_client.set(metadata_key, json.dumps([nav_key]))
-        logger.info(f"Stored content and metadata for {nav_key}")
+        # Sections, metadata and the materialized payloads change together
+        pipe = redis_client.pipeline(transaction=True)
+        written_keys = queue_navigation_content(pipe, nav_key, content)
+        pipe.execute()
+
+        publish_invalidation(redis_client, written_keys)
+        logger.info(f"Stored content, metadata and payload for {nav_key}")
     except Exception as e:
         logger.error(f"Failed to store navigation content: {e}", exc_info=True)
         raise
 
+def resolve_navigation_key(path: str) -> str:
+    """Accept both short paths and fully qualified woa.* keys"""
+    return path if path.startswith("woa.") else create_navigation_key(path)
+
+def compute_content_version(documents: Dict[str, str]) -> str:
+    """Hash of every document and the seed format, used to skip unchanged seeding"""
+    digest = hashlib.sha256(f"format:{SEED_FORMAT_VERSION}".encode("utf-8"))
+    for nav_key in sorted(documents):
+        digest.update(b"\0" + nav_key.encode("utf-8") + b"\0" + documents[nav_key].encode("utf-8"))
+    return digest.hexdigest()
+
+def seed_navigation_content(redis_client: redis.Redis, documents: Dict[str, str]) -> bool:
+    """
+    Write a set of documents in one transaction, unless the stored content version already matches.
+    Returns True if anything was written.
+    """
+    version = compute_content_version(documents)
+    if redis_client.get(CONTENT_VERSION_KEY) == version:
+        logger.info(f"Content version {version[:12]} already seeded, skipping {len(documents)} documents")
+        return False
+
+    pipe = redis_client.pipeline(transaction=True)
+    written_keys = []
+    for nav_key, content in documents.items():
+        written_keys.extend(queue_navigation_content(pipe, nav_key, content))
+    pipe.set(CONTENT_VERSION_KEY, version)
+    pipe.execute()
+
+    publish_invalidation(redis_client, written_keys)
+    logger.info(f"Seeded {len(documents)} documents at content version {version[:12]}")
+    return True
+
 def populate_initial_content(redis_client: redis.Redis) -> None:
     """Populate Redis with initial navigation and world content"""
     content_map = {
@@ -81,36 +166,10 @@ Role: Guiding the protagonist on their journey.
 - Strategic Wisdom"""
     }
 
-    content_metadata = {
-        'woa.world.navigation.main.markdown.root.metadata': json.dumps([
-            'woa.world.navigation.main.markdown.root'
-        ]),
-        'woa.world.navigation.city.markdown.index.metadata': json.dumps([
-            'woa.world.navigation.city.markdown.index'
-        ]),
-        'woa.world.navigation.city.markdown.asko_norge.metadata': json.dumps([
-            'woa.world.navigation.city.markdown.asko_norge'
-        ]),
-        'woa.world.navigation.city.markdown.trade_routes.metadata': json.dumps([
-            'woa.world.navigation.city.markdown.trade_routes'
-        ]),
-        'woa.world.characters.markdown.index.metadata': json.dumps([
-            'woa.world.characters.markdown.index'
-        ]),
-        'woa.world.characters.markdown.hero.metadata': json.dumps([
-            'woa.world.characters.markdown.hero'
-        ]),
-        'woa.world.characters.markdown.mentor.metadata': json.dumps([
-            'woa.world.characters.markdown.mentor'
-        ])
-    }
-
     try:
-        for path, content in content_map.items():
-            nav_key = create_navigation_key(path)
-            store_navigation_content(redis_client, nav_key, content)
-
-        logger.info("✅ Successfully populated initial content")
+        documents = {resolve_navigation_key(path): content for path, content in content_map.items()}
+        if seed_navigation_content(redis_client, documents):
+            logger.info("✅ Successfully populated initial content")
     except Exception as e:
         logger.error(f"❌ Failed to populate content: {e}", exc_info=True)
         raise
\ No newline at end of file
@@ -0,0 +1,143 @@
+# section_store.py
+import json
+import hashlib
+import logging
+from typing import Dict, List, Tuple
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Section markdown is stored once per distinct content under blob:{sha256}, no
+# matter how many documents or versions use it. Document .metadata lists and
+# version manifests point at blob keys, and every pointer is counted in
+# BLOB_REFS_KEY. A blob whose count drops to zero is parked in BLOB_GARBAGE_KEY
+# and deleted by collect_garbage once it has stayed unreferenced for the grace
+# period, so readers holding a just-replaced metadata list never see it vanish.
+BLOB_PREFIX = "blob:"
+BLOB_REFS_KEY = "blob:refs"
+BLOB_GARBAGE_KEY = "blob:garbage"
+DEFAULT_GC_GRACE = 300.0
+GC_BATCH_SIZE = 500
+
+# Shared by every script that adds or drops a pointer to a blob
+REFCOUNT_FUNCTIONS = """
+local function acquire_blob(refs_key, garbage_key, blob_key)
+    if redis.call('HINCRBY', refs_key, blob_key, 1) == 1 then
+        redis.call('ZREM', garbage_key, blob_key)
+    end
+end
+
+local function release_blob(refs_key, garbage_key, blob_key, now)
+    if redis.call('HINCRBY', refs_key, blob_key, -1) <= 0 then
+        redis.call('HDEL', refs_key, blob_key)
+        redis.call('ZADD', garbage_key, now, blob_key)
+    end
+end
+
+local function server_time()
+    local now = redis.call('TIME')
+    return tonumber(now[1]) + tonumber(now[2]) / 1000000
+end
+"""
+
+# KEYS[1] = "{nav_key}.metadata", KEYS[2] = BLOB_REFS_KEY, KEYS[3] = BLOB_GARBAGE_KEY
+# ARGV[1] = blob prefix, ARGV[2] = new metadata (JSON list of blob keys) or "" to delete,
+# ARGV[3..] = blob key, content pairs for each distinct section
+# New pointers are counted before old ones are dropped, so a section kept across
+# the rewrite never reaches zero. Entries of the old per-document layout
+# ({nav_key}.section.N or the nav_key itself) are deleted outright.
+# Blob keys are built from ARGV, so this relies on a non-clustered cache.
+REPLACE_SECTIONS_SCRIPT = REFCOUNT_FUNCTIONS + """
+for i = 3, #ARGV, 2 do
+    redis.call('SET', ARGV[i], ARGV[i + 1], 'NX')
+end
+
+if ARGV[2] ~= '' then
+    for _, blob_key in ipairs(cjson.decode(ARGV[2])) do
+        acquire_blob(KEYS[2], KEYS[3], blob_key)
+    end
+end
+
+local old = redis.call('GET', KEYS[1])
+if old then
+    local now = server_time()
+    for _, section_key in ipairs(cjson.decode(old)) do
+        if string.sub(section_key, 1, #ARGV[1]) == ARGV[1] then
+            release_blob(KEYS[2], KEYS[3], section_key, now)
+        else
+            redis.call('DEL', section_key)
+        end
+    end
+end
+
+if ARGV[2] == '' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# KEYS[1] = BLOB_GARBAGE_KEY, KEYS[2] = BLOB_REFS_KEY
+# ARGV[1] = grace period in seconds, ARGV[2] = batch size
+# Returns {examined, deleted}; blobs referenced again since they were parked are kept
+COLLECT_GARBAGE_SCRIPT = REFCOUNT_FUNCTIONS + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', server_time() - tonumber(ARGV[1]),
+                       'LIMIT', 0, tonumber(ARGV[2]))
+local deleted = 0
+for _, blob_key in ipairs(due) do
+    if not redis.call('HGET', KEYS[2], blob_key) then
+        deleted = deleted + redis.call('DEL', blob_key)
+    end
+    redis.call('ZREM', KEYS[1], blob_key)
+end
+return {#due, deleted}
+"""
+
+
+def hash_blob(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def create_blob_key(content_hash: str) -> str:
+    return f"{BLOB_PREFIX}{content_hash}"
+
+
+def build_blobs(sections: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """Blob key of every section in order, and the content of each distinct blob"""
+    blob_keys = [create_blob_key(hash_blob(section)) for section in sections]
+    return blob_keys, dict(zip(blob_keys, sections))
+
+
+def _queue_replace_sections(pipe, metadata_key: str, metadata: str, blobs: Dict[str, str]) -> None:
+    args = [BLOB_PREFIX, metadata]
+    for blob_key, content in blobs.items():
+        args.extend([blob_key, content])
+    replace_sections = pipe.register_script(REPLACE_SECTIONS_SCRIPT)
+    replace_sections(keys=[metadata_key, BLOB_REFS_KEY, BLOB_GARBAGE_KEY], args=args, client=pipe)
+
+
+def queue_document_sections(pipe, metadata_key: str, sections: List[str]) -> List[str]:
+    """Queue writing a document's sections as shared blobs and pointing its metadata at them"""
+    blob_keys, blobs = build_blobs(sections)
+    _queue_replace_sections(pipe, metadata_key, json.dumps(blob_keys), blobs)
+    return blob_keys
+
+
+def queue_document_removal(pipe, metadata_key: str) -> None:
+    """Queue deleting a document's metadata and releasing the blobs it pointed at"""
+    _queue_replace_sections(pipe, metadata_key, "", {})
+
+
+def collect_garbage(redis_client: redis.Redis, grace: float = DEFAULT_GC_GRACE) -> int:
+    """Delete blobs that have been unreferenced for at least `grace` seconds; returns how many"""
+    collect = redis_client.register_script(COLLECT_GARBAGE_SCRIPT)
+    deleted = 0
+    while True:
+        examined, batch_deleted = collect(keys=[BLOB_GARBAGE_KEY, BLOB_REFS_KEY], args=[grace, GC_BATCH_SIZE])
+        deleted += batch_deleted
+        if examined < GC_BATCH_SIZE:
+            break
+    if deleted:
+        logger.info(f"🧹 Collected {deleted} unreferenced section blobs")
+    return deleted
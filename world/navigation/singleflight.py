@@ -0,0 +1,108 @@
+# singleflight.py
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DUPLICATE_WINDOW = 0.5
+
+
+class DuplicateFilter:
+    """
+    Remembers each sender's most recent request for a short window.
+
+    Requests are compared by a key built from the parsed message, without
+    per-message fields such as the client's request id, so a repeated click on
+    the same page is dropped while a delta request with different section
+    hashes is not. Only the latest request counts: going A -> B -> A within the
+    window still serves the second A.
+    """
+
+    def __init__(self, window: float = DEFAULT_DUPLICATE_WINDOW):
+        self.window = window
+        self._last: Dict[str, Tuple[Hashable, float]] = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def is_duplicate(self, sender: str, key: Hashable) -> bool:
+        if self.window <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._last = {cid: last for cid, last in self._last.items() if last[1] > now}
+                self._next_prune = now + self.window
+            last = self._last.get(sender)
+            if last and last[0] == key and last[1] > now:
+                return True
+            self._last[sender] = (key, now + self.window)
+            return False
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Concurrent loads of the same key share one call.
+
+    The first caller runs the loader; callers arriving while it is in flight
+    wait for and receive the same result (or exception). Nothing is kept once
+    the call completes; caching stays with NavigationCache.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._calls_lock = threading.Lock()
+
+    def do(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._calls_lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = loader()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._calls_lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.waiters:
+                logger.debug(f"Shared load of {key} with {call.waiters} waiting request(s)")
+
+
+class AsyncSingleFlight:
+    """asyncio variant of SingleFlight; waiters share the leader's task"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: one cancelled waiter must not cancel the load for the others
+        return await asyncio.shield(task)
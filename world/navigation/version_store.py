@@ -0,0 +1,263 @@
+# version_store.py
+import re
+import json
+import logging
+from typing import List, Optional, Tuple
+import redis
+import redis.asyncio as redis_asyncio
+from section_store import BLOB_PREFIX, BLOB_REFS_KEY, BLOB_GARBAGE_KEY, REFCOUNT_FUNCTIONS, hash_blob
+
+logger = logging.getLogger(__name__)
+
+# Layout from mardown-data-format.md section 4, with nav_keys as document names:
+#   blob:{sha256}              -> section markdown, shared through section_store
+#   doc:{nav_key}:{version}    -> Hash: created, title, sections, section_ids, section:{id}
+#   versions:{nav_key}         -> Sorted Set, score: timestamp, member: version id (v1, v2, ...)
+#   versions:{nav_key}:counter -> last version number handed out
+#   {nav_key}.version          -> version the live document belongs to, set with the live write
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+# Versions kept per document; older manifests are dropped and release their blobs. 0 keeps all.
+DEFAULT_VERSION_HISTORY = 20
+
+# KEYS[1] = versions:{nav_key}, KEYS[2] = versions:{nav_key}:counter,
+# KEYS[3] = blob refcounts, KEYS[4] = blob garbage set, KEYS[5] = live version key (optional)
+# ARGV[1] = "doc:{nav_key}:", ARGV[2] = blob prefix, ARGV[3] = title,
+# ARGV[4] = sections (JSON list of hashes), ARGV[5] = section ids (JSON list),
+# ARGV[6] = versions to keep (0 = all), ARGV[7..] = hash, content pairs
+# Returns the version id. Blobs are written only if absent, and no version is
+# added when the sections match the latest one, so rewriting identical content
+# is free. Version manifests are new keys; existing versions are never modified,
+# only dropped once they fall out of the history. Each manifest holds a reference
+# on its blobs; "counted" marks manifests whose references are in the refcounts.
+# When the live document is written in the same transaction, KEYS[5] records
+# which version it is, so replies can name it without another lookup.
+# Blob and manifest keys are built from ARGV, so this relies on a non-clustered cache.
+COMMIT_VERSION_SCRIPT = REFCOUNT_FUNCTIONS + """
+local latest = redis.call('ZREVRANGE', KEYS[1], 0, 0)[1]
+if latest and redis.call('HGET', ARGV[1] .. latest, 'sections') == ARGV[4] then
+    if KEYS[5] then
+        redis.call('SET', KEYS[5], latest)
+    end
+    return latest
+end
+
+for i = 7, #ARGV, 2 do
+    redis.call('SET', ARGV[2] .. ARGV[i], ARGV[i + 1], 'NX')
+end
+
+local version = 'v' .. redis.call('INCR', KEYS[2])
+local created = server_time()
+local manifest = {'created', tostring(created), 'title', ARGV[3], 'sections', ARGV[4],
+                  'section_ids', ARGV[5], 'counted', '1'}
+local hashes = cjson.decode(ARGV[4])
+for i, section_id in ipairs(cjson.decode(ARGV[5])) do
+    manifest[#manifest + 1] = 'section:' .. section_id
+    manifest[#manifest + 1] = hashes[i]
+    acquire_blob(KEYS[3], KEYS[4], ARGV[2] .. hashes[i])
+end
+redis.call('HSET', ARGV[1] .. version, unpack(manifest))
+redis.call('ZADD', KEYS[1], created, version)
+if KEYS[5] then
+    redis.call('SET', KEYS[5], version)
+end
+
+local keep = tonumber(ARGV[6])
+if keep > 0 then
+    for _, expired in ipairs(redis.call('ZRANGE', KEYS[1], 0, -(keep + 1))) do
+        local expired_key = ARGV[1] .. expired
+        local fields = redis.call('HMGET', expired_key, 'sections', 'counted')
+        if fields[1] and fields[2] then
+            for _, hash in ipairs(cjson.decode(fields[1])) do
+                release_blob(KEYS[3], KEYS[4], ARGV[2] .. hash, created)
+            end
+        end
+        redis.call('DEL', expired_key)
+        redis.call('ZREM', KEYS[1], expired)
+    end
+end
+return version
+"""
+
+# KEYS[1] = versions:{nav_key}, KEYS[2] = blob refcounts, KEYS[3] = blob garbage set
+# ARGV[1] = "doc:{nav_key}:", ARGV[2] = blob prefix
+# Deletes every manifest of a removed document and releases the blob references
+# they hold, so the blobs become collectable. The counter is kept, so a document
+# imported again later never reuses a version id an old reference may name.
+DROP_HISTORY_SCRIPT = REFCOUNT_FUNCTIONS + """
+local now = server_time()
+local versions = redis.call('ZRANGE', KEYS[1], 0, -1)
+for _, version in ipairs(versions) do
+    local manifest_key = ARGV[1] .. version
+    local fields = redis.call('HMGET', manifest_key, 'sections', 'counted')
+    if fields[1] and fields[2] then
+        for _, hash in ipairs(cjson.decode(fields[1])) do
+            release_blob(KEYS[2], KEYS[3], ARGV[2] .. hash, now)
+        end
+    end
+    redis.call('DEL', manifest_key)
+end
+redis.call('DEL', KEYS[1])
+return #versions
+"""
+
+# KEYS[1] = versions:{nav_key}
+# ARGV[1] = "doc:{nav_key}:", ARGV[2] = blob prefix, ARGV[3] = version id or "" for the latest
+# Returns {version, section blobs...} or nil, read in one round trip
+READ_VERSION_SCRIPT = """
+local version = ARGV[3]
+if version == '' then
+    version = redis.call('ZREVRANGE', KEYS[1], 0, 0)[1]
+    if not version then
+        return nil
+    end
+end
+
+local sections = redis.call('HGET', ARGV[1] .. version, 'sections')
+if not sections then
+    return nil
+end
+
+local result = {version}
+for _, hash in ipairs(cjson.decode(sections)) do
+    result[#result + 1] = redis.call('GET', ARGV[2] .. hash) or ''
+end
+return result
+"""
+
+
+def create_versions_key(nav_key: str) -> str:
+    return f"versions:{nav_key}"
+
+
+def create_version_counter_key(nav_key: str) -> str:
+    return f"versions:{nav_key}:counter"
+
+
+def create_version_key(nav_key: str, version: str) -> str:
+    """Spec document key of one version, e.g. doc:woa.world.navigation.city.markdown.index:v3"""
+    return f"doc:{nav_key}:{version}"
+
+
+def slugify(title: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
+
+
+def create_section_ids(sections: List[str]) -> List[str]:
+    """
+    Section ids used by [[doc:name:version:section:id]] references.
+
+    The id is the slug of the section's first heading ("## Main Routes" ->
+    main-routes), or its index when it has none; repeats get the index appended.
+    """
+    section_ids = []
+    for index, section in enumerate(sections):
+        heading = HEADING_PATTERN.search(section)
+        section_id = slugify(heading.group(1)) if heading else ""
+        if not section_id or section_id in section_ids:
+            section_id = f"{section_id}-{index}" if section_id else str(index)
+        section_ids.append(section_id)
+    return section_ids
+
+
+def document_title(sections: List[str]) -> str:
+    for section in sections:
+        heading = HEADING_PATTERN.search(section)
+        if heading:
+            return heading.group(1)
+    return ""
+
+
+def queue_version_commit(pipe,
+                         nav_key: str,
+                         sections: List[str],
+                         history: int = DEFAULT_VERSION_HISTORY,
+                         live_version_key: Optional[str] = None) -> None:
+    """Queue a new version of a document in the same pipeline as its live write, pointing live_version_key at it"""
+    hashes = [hash_blob(section) for section in sections]
+    blobs = []
+    for content_hash, section in dict(zip(hashes, sections)).items():
+        blobs.extend([content_hash, section])
+
+    commit_version = pipe.register_script(COMMIT_VERSION_SCRIPT)
+    keys = [create_versions_key(nav_key), create_version_counter_key(nav_key), BLOB_REFS_KEY, BLOB_GARBAGE_KEY]
+    if live_version_key:
+        keys.append(live_version_key)
+    commit_version(
+        keys=keys,
+        args=[create_version_key(nav_key, ""), BLOB_PREFIX, document_title(sections),
+              json.dumps(hashes), json.dumps(create_section_ids(sections)), history, *blobs],
+        client=pipe
+    )
+
+
+def queue_version_removal(pipe, nav_key: str) -> None:
+    """Queue deleting a removed document's version history in the same pipeline as its removal"""
+    drop_history = pipe.register_script(DROP_HISTORY_SCRIPT)
+    drop_history(
+        keys=[create_versions_key(nav_key), BLOB_REFS_KEY, BLOB_GARBAGE_KEY],
+        args=[create_version_key(nav_key, ""), BLOB_PREFIX],
+        client=pipe
+    )
+
+
+def commit_version(redis_client: redis.Redis,
+                   nav_key: str,
+                   sections: List[str],
+                   history: int = DEFAULT_VERSION_HISTORY) -> str:
+    """Store sections as a new version of a document on their own; returns the version id"""
+    pipe = redis_client.pipeline(transaction=True)
+    queue_version_commit(pipe, nav_key, sections, history)
+    return pipe.execute()[0]
+
+
+def list_versions(redis_client: redis.Redis, nav_key: str) -> List[Tuple[str, float]]:
+    """(version, created) pairs, oldest first"""
+    return redis_client.zrange(create_versions_key(nav_key), 0, -1, withscores=True)
+
+
+def _parse_version(result) -> Optional[Tuple[str, List[str]]]:
+    if not result:
+        return None
+    return result[0], list(result[1:])
+
+
+def get_version_sections(redis_client: redis.Redis,
+                         nav_key: str,
+                         version: Optional[str] = None) -> Optional[Tuple[str, List[str]]]:
+    """
+    Sections of one version of a document, or of the latest when version is None.
+
+    Manifests and blobs are immutable once written and the read is one script,
+    so the result is a consistent snapshot even while newer versions are being
+    committed. Versions older than the kept history are gone.
+    """
+    try:
+        read_version = redis_client.register_script(READ_VERSION_SCRIPT)
+        return _parse_version(read_version(
+            keys=[create_versions_key(nav_key)],
+            args=[create_version_key(nav_key, ""), BLOB_PREFIX, version or ""]
+        ))
+    except Exception as e:
+        logger.error(f"Failed to read version {version or 'latest'} of {nav_key}: {e}", exc_info=True)
+        return None
+
+
+async def get_version_sections_async(redis_client: redis_asyncio.Redis,
+                                     nav_key: str,
+                                     version: Optional[str] = None) -> Optional[Tuple[str, List[str]]]:
+    """asyncio variant of get_version_sections"""
+    try:
+        read_version = redis_client.register_script(READ_VERSION_SCRIPT)
+        return _parse_version(await read_version(
+            keys=[create_versions_key(nav_key)],
+            args=[create_version_key(nav_key, ""), BLOB_PREFIX, version or ""]
+        ))
+    except Exception as e:
+        logger.error(f"Failed to read version {version or 'latest'} of {nav_key}: {e}", exc_info=True)
+        return None
+
+
+def get_version_content(redis_client: redis.Redis, nav_key: str, version: Optional[str] = None) -> Optional[str]:
+    """Assembled markdown of one version of a document"""
+    snapshot = get_version_sections(redis_client, nav_key, version)
+    return "\n\n".join(snapshot[1]) if snapshot else None
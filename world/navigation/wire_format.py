@@ -0,0 +1,42 @@
+# wire_format.py
+import logging
+from typing import Iterable, Tuple, Union
+from markdown_pb2 import MarkdownMessage
+
+logger = logging.getLogger(__name__)
+
+ENCODING_JSON = "json"
+ENCODING_PROTOBUF = "protobuf"
+JSON_CONTENT_TYPE = "application/json"
+PROTOBUF_CONTENT_TYPE = "application/octet-stream"
+
+
+def negotiate_encoding(message: dict) -> str:
+    """Clients opt into binary frames with "encoding": "protobuf"; everyone else gets JSON"""
+    if str(message.get('encoding', ENCODING_JSON)).lower() == ENCODING_PROTOBUF:
+        return ENCODING_PROTOBUF
+    return ENCODING_JSON
+
+
+def content_type_for(response: Union[str, bytes]) -> str:
+    """Content type for replies: protobuf frames are bytes, JSON envelopes are text"""
+    return PROTOBUF_CONTENT_TYPE if isinstance(response, bytes) else JSON_CONTENT_TYPE
+
+
+def encode_markdown_message(message_type: str,
+                            content: str = "",
+                            filename: str = "",
+                            sections: Iterable[Tuple[str, str, str]] = (),
+                            removed: Iterable[str] = (),
+                            version: str = "") -> bytes:
+    """Serialize a MarkdownMessage frame (see woa/app/domain/markdown.proto)"""
+    message = MarkdownMessage(type=message_type, filename=filename, content=content, version=version)
+    for section_id, section_hash, section_content in sections:
+        message.sections.add(id=section_id, hash=section_hash, content=section_content)
+    message.removed.extend(removed)
+    return message.SerializeToString()
+
+
+def encode_version_frame(version: str) -> bytes:
+    """A MarkdownMessage holding only a version; appended to a frame it sets that frame's version"""
+    return MarkdownMessage(version=version).SerializeToString()